@@ -0,0 +1,52 @@
+import os
+import sys
+import argparse
+import importlib
+
+sys.path.append(os.path.abspath(os.path.dirname(__file__)))
+
+# Subcommand -> module in `scripts` and a short description. A module is only
+# imported when its subcommand is run, and it imports heavy libraries only
+# inside `main()`, so `--help` and light subcommands start fast
+COMMANDS = {
+    "download": ("scripts.download_logs", "order and download reports to TSV"),
+    "reports": ("scripts.reports", "list and delete existing reports"),
+    "clickhouse": ("scripts.clickhouse", "create Clickhouse tables and import TSV files"),
+    "daemon": ("scripts.daemon", "keep Clickhouse tables in sync with Logs API"),
+    "load": ("scripts.load", "load a TSV file into DuckDB or SQLite"),
+    "profile": ("scripts.profile_data", "recommend column types for a TSV file"),
+}
+
+PROG = os.path.basename(sys.argv[0])
+
+
+def print_help():
+    print(f"usage: {PROG} COMMAND [ARGS…]\n")
+    print("Toolkit for working with Yandex Metrika data via Logs API\n")
+    print("commands:")
+    for name, (_, description) in COMMANDS.items():
+        print(f"  {name:<12}{description}")
+    print(f"\nRun `{PROG} COMMAND -h` for help on a command.")
+
+
+def main(argv: list[str]):
+    if not argv or argv[0] in ("-h", "--help"):
+        print_help()
+        exit(0)
+
+    command, command_args = argv[0], argv[1:]
+    if command not in COMMANDS:
+        print(f"Unknown command: {command}\n", file=sys.stderr)
+        print_help()
+        exit(2)
+
+    module = importlib.import_module(COMMANDS[command][0])
+    arg_parser = argparse.ArgumentParser(
+        prog=f"{PROG} {command}", description=module.DESCRIPTION
+    )
+    module.add_arguments(arg_parser)
+    module.main(arg_parser.parse_args(command_args))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -3,6 +3,13 @@ from utils.utils import populate_with_attribution
 # Report readiness check interval (seconds)
 WAIT_INTERVAL = 10
 
+# Storage quota for the reports of a counter (bytes). Reports are counted until
+# they are cleaned, see the current limit in the Logs API documentation
+LOGS_API_QUOTA = 10 * 1024 * 1024 * 1024
+
+# Free quota check interval (seconds), `download_logs.py --wait-for-quota`
+QUOTA_WAIT_INTERVAL = 60
+
 # https://yandex.com/dev/metrika/en/logs/param
 #
 # first, last, lastsign, last_yandex_direct_click, automatic
@@ -16,6 +23,46 @@ DOWNLOAD_SOURCE = "visits"
 # The number of rows that are loaded into Clickhouse at a time
 CLICKHOUSE_BATCH_SIZE = 10_000
 
+# How `clickhouse.py` splits the input into batches:
+#
+# - rows: a fixed number of rows, `CLICKHOUSE_BATCH_SIZE`
+# - bytes: rows are accumulated until the batch reaches `CLICKHOUSE_BATCH_BYTES`
+# - adaptive: the number of rows is tuned from the observed insert time
+CLICKHOUSE_BATCH_MODE = "rows"
+
+# Target batch size in bytes of the input file (the `bytes` mode). In the
+# `adaptive` mode it is used as an upper limit, `None` disables the limit
+CLICKHOUSE_BATCH_BYTES = 32 * 1024 * 1024
+
+# The `adaptive` mode: how long one insert should take (seconds), and the hard
+# bounds of the batch size in rows. `CLICKHOUSE_BATCH_SIZE` is the initial size.
+# `CLICKHOUSE_ADAPTIVE_MAX_ROWS` also limits batches in the `bytes` mode
+CLICKHOUSE_ADAPTIVE_TARGET_SECONDS = 2.0
+CLICKHOUSE_ADAPTIVE_MIN_ROWS = 1_000
+CLICKHOUSE_ADAPTIVE_MAX_ROWS = 1_000_000
+
+# How to connect to Clickhouse:
+#
+# - http: the HTTP interface (`clickhouse-connect`), port 8123 by default
+# - native: the native TCP protocol (`clickhouse-driver` must be installed),
+#   port 9000 by default
+CLICKHOUSE_TRANSPORT = "http"
+
+# Compression of the data sent to Clickhouse: none, lz4, zstd. zstd compresses
+# better at the cost of more CPU, suits slow links between data centers
+CLICKHOUSE_COMPRESSION = "lz4"
+
+# Maximum number of HTTP connections kept open (the `http` transport)
+CLICKHOUSE_POOL_SIZE = 8
+
+# Timeouts (seconds) for connecting and for sending/receiving data
+CLICKHOUSE_CONNECT_TIMEOUT = 10
+CLICKHOUSE_SEND_RECEIVE_TIMEOUT = 300
+
+# Clickhouse settings applied to every query of the session, e.g.
+# {"max_insert_block_size": 1_000_000}
+CLICKHOUSE_SESSION_SETTINGS = {}
+
 # Lists of available fields:
 #
 # https://yandex.com/dev/metrika/en/logs/fields/visits
@@ -171,12 +218,18 @@ CLICKHOUSE_EVENTS_FIELDS = [
 #
 # - $table_name: the name of the table passed to the script
 # - $table_fields: the name of the columns that are derived from the variables above
+# - $order_by: the sorting key, `CLICKHOUSE_*_ORDER_BY` or the one passed to the script
+#
+# `non_replicated_deduplication_window` lets Clickhouse drop repeated batches of
+# a retried or resumed import (`clickhouse.py` sends a deduplication token with
+# every batch). Replicated tables deduplicate inserts by default
 CLICKHOUSE_CREATE_VISITS_TABLE = """
 CREATE TABLE $table_name (
     $table_fields
 ) ENGINE = ReplacingMergeTree()
 PARTITION BY toYYYYMM(date)
-ORDER BY visitID;
+ORDER BY $order_by
+SETTINGS non_replicated_deduplication_window = 1000;
 """
 
 CLICKHOUSE_CREATE_EVENTS_TABLE = """
@@ -184,9 +237,77 @@ CREATE TABLE $table_name (
     $table_fields
 ) ENGINE = ReplacingMergeTree()
 PARTITION BY toYYYYMM(date)
-ORDER BY watchID;
+ORDER BY $order_by
+SETTINGS non_replicated_deduplication_window = 1000;
 """
 
+# Sorting keys of new tables. ReplacingMergeTree removes rows with the same key,
+# so the key must end with the unique ID, e.g. `(date, clientID, visitID)`
+CLICKHOUSE_VISITS_ORDER_BY = "visitID"
+CLICKHOUSE_EVENTS_ORDER_BY = "watchID"
+
+# Cluster mode (`clickhouse.py --cluster`): the name of the cluster from the
+# `remote_servers` server configuration, `None` to work with a single server
+CLICKHOUSE_CLUSTER = None
+
+# Tables on the nodes of a cluster. `Distributed` tables over them are created
+# automatically. Substitution is the same as above, plus:
+#
+# - $cluster: the name of the cluster
+#
+# {shard} and {replica} are macros from the server configuration
+CLICKHOUSE_CREATE_CLUSTER_VISITS_TABLE = """
+CREATE TABLE $table_name ON CLUSTER $cluster (
+    $table_fields
+) ENGINE = ReplicatedReplacingMergeTree('/clickhouse/tables/{shard}/{database}/$table_name', '{replica}')
+PARTITION BY toYYYYMM(date)
+ORDER BY $order_by;
+"""
+
+CLICKHOUSE_CREATE_CLUSTER_EVENTS_TABLE = """
+CREATE TABLE $table_name ON CLUSTER $cluster (
+    $table_fields
+) ENGINE = ReplicatedReplacingMergeTree('/clickhouse/tables/{shard}/{database}/$table_name', '{replica}')
+PARTITION BY toYYYYMM(date)
+ORDER BY $order_by;
+"""
+
+# Columns whose `cityHash64()` distributes rows between the shards. Rows with
+# the same ID get to the same shard, so ReplacingMergeTree can deduplicate them
+CLICKHOUSE_VISITS_SHARDING_KEY = "visitID"
+CLICKHOUSE_EVENTS_SHARDING_KEY = "watchID"
+
+# Daemon mode (`daemon.py run`): the counters to keep in sync. A job is added
+# for each of the last `DAEMON_SYNC_DAYS` days (before today) of every counter,
+# and goes through ordering, downloading, importing into the Clickhouse table
+# and cleaning the report. `renamed_fields` is the same as `clickhouse.py -R`
+DAEMON_COUNTERS = [
+    # {"counter_id": 12345678, "source": "visits", "table": "visits"},
+    # {"counter_id": 12345678, "source": "hits", "table": "hits", "renamed_fields": True},
+]
+DAEMON_SYNC_DAYS = 3
+
+# The job store and the directory for the downloaded files of the daemon
+DAEMON_DB = "daemon.sqlite3"
+DAEMON_DATA_DIR = "data"
+
+# Delete the downloaded files once the reports are imported and cleaned
+DAEMON_DELETE_FILES = True
+
+# How many jobs go through each stage at a time
+DAEMON_WORKERS = {
+    "order": 1,
+    "check": 2,
+    "download": 2,
+    "import": 1,
+    "clean": 2,
+}
+
+# How often the daemon adds new jobs (seconds), and how many times a failing
+# stage is attempted, with a growing delay, before the job is put aside
+DAEMON_INTERVAL = 60
+DAEMON_MAX_ATTEMPTS = 5
+
 # Dictionary for renaming attribution models
 ATTRIBUTION_RENAMING_MAPPING = {
     "first": "first",
@@ -0,0 +1,118 @@
+BATCH_MODES = ["rows", "bytes", "adaptive"]
+
+
+def estimate_row_size(row: list[str]) -> int:
+    """Approximate size of a TSV row in bytes: field lengths plus separators."""
+    return sum(len(value) for value in row) + len(row)
+
+
+class BatchPolicy:
+    """Decides when the accumulated batch should be sent to Clickhouse.
+
+    Base class for the fixed row-count mode: a batch is full once it holds
+    `max_rows` rows.
+    """
+
+    def __init__(self, max_rows: int):
+        self.max_rows = max_rows
+
+    def is_full(self, rows: int, size: int) -> bool:
+        return rows >= self.max_rows
+
+    def record_insert(self, rows: int, size: int, elapsed: float):
+        pass
+
+    def describe(self) -> str:
+        return f"{self.max_rows} rows"
+
+
+class BytesBatchPolicy(BatchPolicy):
+    """The batch is full once its estimated size reaches `max_bytes`.
+
+    `max_rows` is kept as a hard ceiling for files with very narrow rows.
+    """
+
+    def __init__(self, max_bytes: int, max_rows: int):
+        super().__init__(max_rows)
+        self.max_bytes = max_bytes
+
+    def is_full(self, rows: int, size: int) -> bool:
+        return size >= self.max_bytes or rows >= self.max_rows
+
+    def describe(self) -> str:
+        return f"{self.max_bytes} bytes"
+
+
+class AdaptiveBatchPolicy(BatchPolicy):
+    """Tunes the batch size in rows so that one insert takes about `target_seconds`.
+
+    After every insert the ideal size is extrapolated from the observed
+    rows/second rate and the current size moves half-way (geometrically)
+    towards it, which damps the noise of single slow or fast inserts. The
+    result is always clamped to [min_rows, max_rows]. `max_bytes`, if set,
+    still caps a single batch.
+    """
+
+    def __init__(
+        self,
+        target_seconds: float,
+        min_rows: int,
+        max_rows: int,
+        initial_rows: int,
+        max_bytes: int | None = None,
+    ):
+        if min_rows < 1 or min_rows > max_rows:
+            raise ValueError(f"Invalid adaptive batch bounds: {min_rows}..{max_rows}")
+        super().__init__(self._clamp(initial_rows, min_rows, max_rows))
+        self.target_seconds = target_seconds
+        self.min_rows = min_rows
+        self.max_rows_limit = max_rows
+        self.max_bytes = max_bytes
+
+    @staticmethod
+    def _clamp(value: int, low: int, high: int) -> int:
+        return max(low, min(high, value))
+
+    def is_full(self, rows: int, size: int) -> bool:
+        if self.max_bytes and size >= self.max_bytes:
+            return True
+        return rows >= self.max_rows
+
+    def record_insert(self, rows: int, size: int, elapsed: float):
+        if rows == 0 or elapsed <= 0:
+            return
+        ideal_rows = rows * self.target_seconds / elapsed
+        new_rows = int((self.max_rows * ideal_rows) ** 0.5)
+        self.max_rows = self._clamp(new_rows, self.min_rows, self.max_rows_limit)
+
+    def describe(self) -> str:
+        return (
+            f"adaptive, {self.min_rows}..{self.max_rows_limit} rows, "
+            f"target {self.target_seconds}s per insert"
+        )
+
+
+def make_batch_policy(
+    mode: str,
+    batch_size: int,
+    batch_bytes: int | None,
+    adaptive_target_seconds: float,
+    adaptive_min_rows: int,
+    adaptive_max_rows: int,
+) -> BatchPolicy:
+    if mode == "rows":
+        return BatchPolicy(batch_size)
+    elif mode == "bytes":
+        if not batch_bytes:
+            raise ValueError("`CLICKHOUSE_BATCH_BYTES` must be set for the `bytes` mode")
+        return BytesBatchPolicy(batch_bytes, adaptive_max_rows)
+    elif mode == "adaptive":
+        return AdaptiveBatchPolicy(
+            target_seconds=adaptive_target_seconds,
+            min_rows=adaptive_min_rows,
+            max_rows=adaptive_max_rows,
+            initial_rows=batch_size,
+            max_bytes=batch_bytes,
+        )
+    else:
+        raise ValueError(f"Unsupported batch mode: {mode}")
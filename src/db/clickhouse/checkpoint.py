@@ -0,0 +1,104 @@
+import os
+import json
+import hashlib
+import threading
+from dataclasses import dataclass, asdict, field
+
+# How much of the beginning and the end of the file is hashed to identify it
+FILE_SAMPLE_SIZE = 1024 * 1024
+
+
+def file_identity(fname: str) -> str:
+    """Identify a file by its size and the contents of its head and tail.
+
+    Cheap even for multi-gigabyte files and, unlike the modification time,
+    stays the same when an identical report is downloaded again.
+    """
+    size = os.path.getsize(fname)
+    digest = hashlib.sha1(str(size).encode())
+    with open(fname, "rb") as f:
+        digest.update(f.read(FILE_SAMPLE_SIZE))
+        if size > FILE_SAMPLE_SIZE:
+            f.seek(max(FILE_SAMPLE_SIZE, size - FILE_SAMPLE_SIZE))
+            digest.update(f.read())
+    return digest.hexdigest()[:16]
+
+
+def deduplication_token(
+    file_id: str, table: str, batch_num: int, first_row: int, last_row: int
+) -> str:
+    """Deterministic `insert_deduplication_token` of a batch.
+
+    The row range is a part of the token, so a batch of the same number but
+    with other boundaries (e.g. after changing the batch mode) is not taken
+    for a duplicate.
+    """
+    return f"{table}:{file_id}:{batch_num}:{first_row}-{last_row}"
+
+
+@dataclass
+class Checkpoint:
+    file_id: str
+    table: str
+    # Number of the last committed batch and the number of rows in the file
+    # (excluding the header) that have been committed up to and including it
+    batch_num: int = 0
+    rows_committed: int = 0
+    # Last row of the batch being sent, recorded before sending it, so that
+    # a resumed import sends the same rows with the same deduplication token
+    # even if the batch size has changed since
+    rows_pending: int = 0
+    completed: bool = False
+    # IDs of the partitions the committed rows were written to
+    partitions: list[str] = field(default_factory=list)
+
+
+def checkpoint_filename(input_fname: str, table: str) -> str:
+    return f"{input_fname}.{table}.checkpoint"
+
+
+def load_checkpoint(fname: str) -> Checkpoint | None:
+    if not os.path.exists(fname):
+        return None
+    with open(fname, "r") as f:
+        return Checkpoint(**json.load(f))
+
+
+def save_checkpoint(fname: str, checkpoint: Checkpoint):
+    """Write the checkpoint atomically, so that a crash never leaves a torn file."""
+    tmp_fname = fname + ".tmp"
+    with open(tmp_fname, "w") as f:
+        json.dump(asdict(checkpoint), f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_fname, fname)
+
+
+class ImportLedger:
+    """Files imported completely into each table, recorded by their identity.
+
+    A directory can be scanned again and again without importing a file
+    twice, even after it is renamed or copied. Safe to share between threads.
+    """
+
+    def __init__(self, fname: str):
+        self.fname = fname
+        self.lock = threading.Lock()
+        self.entries: set[tuple[str, str]] = set()
+        if os.path.exists(fname):
+            with open(fname, "r") as f:
+                for line in f:
+                    file_id, table, _ = line.rstrip("\n").split("\t", 2)
+                    self.entries.add((file_id, table))
+
+    def __contains__(self, entry: tuple[str, str]) -> bool:
+        return entry in self.entries
+
+    def add(self, file_id: str, table: str, input_fname: str):
+        with self.lock:
+            os.makedirs(os.path.dirname(self.fname) or ".", exist_ok=True)
+            with open(self.fname, "a") as f:
+                f.write(f"{file_id}\t{table}\t{input_fname}\n")
+                f.flush()
+                os.fsync(f.fileno())
+            self.entries.add((file_id, table))
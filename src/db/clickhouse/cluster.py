@@ -0,0 +1,109 @@
+from dataclasses import dataclass
+
+UINT64_MASK = (1 << 64) - 1
+
+
+def local_table_name(table: str) -> str:
+    """Name of the table on every node behind the `Distributed` table."""
+    return f"{table}_local"
+
+
+def city_hash64(value: int) -> int:
+    """`cityHash64()` of a single integer argument, as Clickhouse computes it.
+
+    For integers Clickhouse doesn't hash the bytes with CityHash but uses
+    `intHash64()` of the value xored with a constant.
+    """
+    x = (value ^ 0x4CF2D2BAAE6DA887) & UINT64_MASK
+    x ^= x >> 33
+    x = (x * 0xFF51AFD7ED558CCD) & UINT64_MASK
+    x ^= x >> 33
+    x = (x * 0xC4CEB9FE1A85EC53) & UINT64_MASK
+    x ^= x >> 33
+    return x
+
+
+def is_sharding_key_type(column_type: str) -> bool:
+    """Whether the client routes rows by a column the same way as the server.
+
+    `city_hash64()` matches the server only for non-negative integers, so
+    the sharding key must be an unsigned integer that is never NULL.
+    """
+    return column_type.split(" ")[0].startswith("UInt")
+
+
+def sharding_expression(sharding_key: str) -> str:
+    return f"cityHash64({sharding_key})"
+
+
+def check_sharding_hash(client):
+    """Make sure that rows are routed to the shards the server would choose."""
+    value = 1234567890123456789
+    result = client.query(f"SELECT cityHash64(toUInt64({value}))").result_rows
+    if result[0][0] != city_hash64(value):
+        raise RuntimeError(
+            "cityHash64() of the server differs from the client one, "
+            "insert through the Distributed table instead"
+        )
+
+
+@dataclass
+class Shard:
+    num: int
+    weight: int
+    host: str
+
+
+def get_shards(client, cluster: str) -> list[Shard]:
+    """The shards of a cluster with the first replica of each one.
+
+    Replicated tables copy an insert to the other replicas of the shard.
+    """
+    result = client.query(
+        "SELECT shard_num, shard_weight, host_name FROM system.clusters "
+        f"WHERE cluster = '{cluster}' AND replica_num = 1 ORDER BY shard_num"
+    ).result_rows
+    return [Shard(num, weight, host) for num, weight, host in result]
+
+
+class ShardRouter:
+    """Splits batches by shards the same way as a `Distributed` table.
+
+    The remainder of dividing the sharding key hash by the total weight of the
+    shards selects a shard, with the ranges of remainders going to the shards
+    in order according to their weights.
+    """
+
+    def __init__(self, shards: list[Shard], key_idx: int):
+        self.shards = shards
+        self.key_idx = key_idx
+        self.slots = []
+        for shard in shards:
+            self.slots.extend([shard] * shard.weight)
+
+    def shard_of(self, row: list) -> Shard:
+        key = row[self.key_idx] or 0
+        return self.slots[city_hash64(key) % len(self.slots)]
+
+    def split(self, batch: list[list]) -> dict[int, list[list]]:
+        """Rows of the batch by shard numbers, keeping their order."""
+        shard_batches = {}
+        for row in batch:
+            shard_batches.setdefault(self.shard_of(row).num, []).append(row)
+        return shard_batches
+
+
+def create_cluster_tables(
+    client,
+    local_table_query: str,
+    table: str,
+    cluster: str,
+    sharding_key: str,
+):
+    """Create the replicated local tables on the cluster and a `Distributed` one."""
+    client.command(local_table_query)
+    client.command(
+        f"CREATE TABLE {table} ON CLUSTER {cluster} AS {local_table_name(table)} "
+        f"ENGINE = Distributed({cluster}, currentDatabase(), "
+        f"{local_table_name(table)}, {sharding_expression(sharding_key)})"
+    )
@@ -0,0 +1,199 @@
+import re
+from datetime import date, datetime
+from functools import lru_cache
+from typing import Any, Callable, Iterable
+
+# Quoted elements of an array, e.g. `['a','b\'c']`, with the escapes of the
+# Clickhouse text formats Logs API writes arrays in
+QUOTED_ELEMENT = re.compile(r"'((?:[^'\\]|\\.)*)'")
+ESCAPE_SEQUENCE = re.compile(r"\\(.)")
+ESCAPED_CHARS = {"b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t", "0": "\0"}
+ESCAPES = str.maketrans(
+    {"\\": "\\\\", "'": "\\'", **{char: "\\" + code for code, char in ESCAPED_CHARS.items()}}
+)
+
+# Quotes and backslashes around scalar values are dropped
+QUOTE_CHARS = "\\'"
+
+# Date and DateTime values repeat a lot, so every converter keeps this many
+# last distinct values parsed
+TIMESTAMP_CACHE_SIZE = 4096
+# How DateTime values are passed on: as `datetime` objects, or as Unix
+# timestamps, which `clickhouse-connect` inserts without converting each value
+TIMESTAMP_FORMATS = ["datetime", "epoch"]
+
+# Distinct values of a low-cardinality column stored once, the values beyond
+# them are kept as they are
+INTERN_TABLE_SIZE = 10_000
+
+
+def unescape(value: str) -> str:
+    return ESCAPE_SEQUENCE.sub(lambda m: ESCAPED_CHARS.get(m.group(1), m.group(1)), value)
+
+
+def escape(value: str) -> str:
+    """The inverse of `unescape()`, for quoted elements of arrays."""
+    return value.translate(ESCAPES)
+
+
+def unwrap_nullable(column_type: str) -> str:
+    return column_type[9:-1] if column_type.startswith("Nullable") else column_type
+
+
+def parse_epoch(value: str) -> int:
+    # The same local time interpretation as `clickhouse-connect` has for naive
+    # datetime objects
+    return int(datetime.fromisoformat(value).timestamp())
+
+
+def value_parser(column_type: str, timestamps: str = "datetime") -> Callable[[str], Any]:
+    """Parser of a non-empty, unquoted value of a scalar type."""
+    if column_type.startswith("UInt") or column_type.startswith("Int"):
+        return int
+    elif column_type == "Float32" or column_type == "Float64":
+        return float
+    elif column_type == "Date":
+        # Fixed `YYYY-MM-DD` and `YYYY-MM-DD hh:mm:ss` formats are parsed in C,
+        # several times faster than with strptime()
+        return lru_cache(maxsize=TIMESTAMP_CACHE_SIZE)(date.fromisoformat)
+    elif column_type == "DateTime":
+        parse = parse_epoch if timestamps == "epoch" else datetime.fromisoformat
+        return lru_cache(maxsize=TIMESTAMP_CACHE_SIZE)(parse)
+    elif column_type == "String":
+        return str
+    else:
+        raise ValueError(f"Unsupported type: {column_type}")
+
+
+def array_parser(inner_type: str, timestamps: str = "datetime") -> Callable[[str], list]:
+    """Parser of a whole array, `[1,2]` or `['a','b']`, into typed elements.
+
+    Quoted elements are found with one regular expression, so commas and
+    escaped quotes inside them are kept. Empty elements are None, except
+    for strings.
+    """
+    inner_type = unwrap_nullable(inner_type)
+    parse = value_parser(inner_type, timestamps)
+    is_string = inner_type == "String"
+
+    def parse_array(value: str) -> list:
+        value = value.strip("[]")
+        if not value:
+            return []
+        if value[0] == "'":
+            if "\\" in value:
+                elements = [unescape(e) for e in QUOTED_ELEMENT.findall(value)]
+            else:
+                # Without escapes, a quote is always next to a separator
+                elements = value[1:-1].split("','")
+            if is_string:
+                return elements
+        else:
+            elements = value.split(",")
+            try:
+                return list(map(parse, elements))
+            except ValueError:
+                # Empty elements, parsed one by one below
+                pass
+        return [parse(e) if e and e != "NULL" else None for e in elements]
+
+    return parse_array
+
+
+def value_converter(column_type: str, timestamps: str = "datetime") -> Callable[[str], Any]:
+    """Converter of raw TSV values of a column."""
+    column_type = unwrap_nullable(column_type)
+    if column_type.startswith("Array"):
+        parse_array = array_parser(column_type[6:-1], timestamps)
+        return lambda value: parse_array(value.strip(QUOTE_CHARS))
+    parse = value_parser(column_type, timestamps)
+    if column_type == "String":
+        return lambda value: value.strip(QUOTE_CHARS)
+
+    def convert(value: str):
+        value = value.strip(QUOTE_CHARS)
+        return parse(value) if value else None
+
+    return convert
+
+
+def default_value(column_type: str) -> Any:
+    """Value Clickhouse stores for an empty value of a non-nullable column."""
+    column_type = unwrap_nullable(column_type)
+    if column_type.startswith("Array"):
+        return []
+    elif column_type.startswith("UInt") or column_type.startswith("Int"):
+        return 0
+    elif column_type == "Float32" or column_type == "Float64":
+        return 0.0
+    elif column_type == "String":
+        return ""
+    else:
+        raise ValueError(f"No default value for type: {column_type}")
+
+
+def string_interner(max_size: int = INTERN_TABLE_SIZE) -> Callable[[str], str]:
+    """Returns the same object for equal strings.
+
+    Millions of values of a low-cardinality column then take a few objects
+    instead of one per row, and their hashes are computed once, which also
+    speeds up building the dictionaries of `LowCardinality` inserts.
+    """
+    table = {}
+
+    def intern(value: str) -> str:
+        interned = table.get(value)
+        if interned is None:
+            if len(table) >= max_size:
+                return value
+            interned = table[value] = value
+        return interned
+
+    return intern
+
+
+# Converters of single values, shared by the columns of a type
+shared_converter = lru_cache(maxsize=None)(value_converter)
+
+
+def compose(outer: Callable, inner: Callable) -> Callable:
+    return lambda value: outer(inner(value))
+
+
+def convert_value(value, column_type):
+    """Convert value to appropriate type based on ClickHouse schema."""
+    return shared_converter(column_type)(value if isinstance(value, str) else str(value))
+
+
+def make_row_converter(
+    column_types: list[str],
+    timestamps: str = "datetime",
+    interned: Iterable[int] = (),
+    not_null: Iterable[int] = (),
+) -> Callable[[list[str]], list]:
+    """Converter of whole rows, for the columns of a file.
+
+    Every column has its own converter, so the values cached for one
+    timestamp column don't push out the ones of another. The values of the
+    `interned` columns, low-cardinality strings, are deduplicated. Empty
+    values of the `not_null` columns become the default of their type.
+    """
+    if timestamps not in TIMESTAMP_FORMATS:
+        raise ValueError(f"Unknown timestamp format: {timestamps}")
+    converters = [value_converter(column_type, timestamps) for column_type in column_types]
+    for idx in interned:
+        converters[idx] = compose(string_interner(), converters[idx])
+    for idx in not_null:
+        default = default_value(column_types[idx])
+        converters[idx] = compose(
+            lambda value, default=default: default if value is None else value, converters[idx]
+        )
+
+    def convert(row: list[str]) -> list:
+        return [converter(value) for converter, value in zip(converters, row)]
+
+    return convert
+
+
+def convert_row(row: list[str], column_types: list[str]) -> list:
+    return [shared_converter(column_type)(value) for value, column_type in zip(row, column_types)]
@@ -0,0 +1,116 @@
+from config import ATTRIBUTION_RENAMING_MAPPING
+
+# Dimensions with a few thousand distinct values at most. The names are given
+# without the `ym:s:`/`ym:pv:` prefix and the attribution model
+LOW_CARDINALITY_FIELDS = {
+    "TrafficSource",
+    "AdvEngine",
+    "ReferalSource",
+    "SearchEngineRoot",
+    "SearchEngine",
+    "SocialNetwork",
+    "RecommendationSystem",
+    "recommendationSystem",
+    "Messenger",
+    "messenger",
+    "UTMMedium",
+    "UTMSource",
+    "DirectPlatformType",
+    "DirectConditionType",
+    "CurrencyID",
+    "regionCountry",
+    "regionCity",
+    "deviceCategory",
+    "mobilePhone",
+    "operatingSystemRoot",
+    "operatingSystem",
+    "browser",
+    "browserEngine",
+    "browserLanguage",
+    "browserCountry",
+    "networkType",
+    "screenFormat",
+    "screenOrientationName",
+    "httpError",
+    "shareService",
+}
+
+# Fields the API always fills in
+NON_NULLABLE_FIELDS = {
+    "clientID",
+}
+
+# Identifiers that grow monotonically and compress well as differences
+ID_FIELDS = {
+    "visitID",
+    "watchID",
+    "pageViewID",
+}
+
+TIMESTAMP_CODEC = "CODEC(DoubleDelta, ZSTD(1))"
+DATE_CODEC = "CODEC(Delta, ZSTD(1))"
+ID_CODEC = "CODEC(Delta, ZSTD(1))"
+DEFAULT_CODEC = "CODEC(ZSTD(1))"
+
+
+def base_field_name(field: str) -> str:
+    """Strip the source prefix and the attribution model from an API field name.
+
+    `ym:s:cross_device_lastTrafficSource` -> `TrafficSource`
+    """
+    name = field.split(":")[-1]
+    for attribution in sorted(ATTRIBUTION_RENAMING_MAPPING, key=len, reverse=True):
+        if name.startswith(attribution) and len(name) > len(attribution):
+            return name[len(attribution):]
+    return name
+
+
+def is_low_cardinality(field: str) -> bool:
+    return base_field_name(field) in LOW_CARDINALITY_FIELDS
+
+
+def is_non_nullable(field: str) -> bool:
+    return base_field_name(field) in NON_NULLABLE_FIELDS
+
+
+def strip_nullable(column_type: str) -> str:
+    if column_type.startswith("Nullable("):
+        return column_type[9:-1]
+    return column_type
+
+
+def strip_low_cardinality(column_type: str) -> str:
+    if column_type.startswith("LowCardinality("):
+        return column_type[15:-1]
+    return column_type
+
+
+def optimized_column_type(field: str, column_type: str) -> str:
+    """Storage-optimized type of a column, with a compression codec.
+
+    Strings are never nullable, since the importer writes an empty string
+    for an empty value anyway. Low-cardinality dimensions are dictionary
+    encoded, timestamps and sequential IDs get delta codecs. Arrays are
+    left as they are.
+    """
+    if column_type.startswith("Array"):
+        return column_type
+
+    name = base_field_name(field)
+    base_type = strip_nullable(column_type)
+
+    if base_type == "String":
+        if name in LOW_CARDINALITY_FIELDS:
+            return "LowCardinality(String)"
+        return f"String {DEFAULT_CODEC}"
+
+    if name in NON_NULLABLE_FIELDS:
+        column_type = base_type
+
+    if base_type == "DateTime":
+        return f"{column_type} {TIMESTAMP_CODEC}"
+    if base_type == "Date":
+        return f"{column_type} {DATE_CODEC}"
+    if name in ID_FIELDS:
+        return f"{column_type} {ID_CODEC}"
+    return f"{column_type} {DEFAULT_CODEC}"
@@ -0,0 +1,97 @@
+import time
+import threading
+from datetime import date
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+
+
+def month_partition_id(value: date) -> str:
+    """Partition ID of a row for the `toYYYYMM(date)` partitioning key."""
+    return f"{value.year}{value.month:02d}"
+
+
+def staging_table_name(table: str, file_id: str) -> str:
+    """The staging table name is stable for a file, so a reload can be resumed."""
+    return f"{table}__reload_{file_id[:8]}"
+
+
+def create_staging_table(client, table: str, staging_table: str):
+    """Create an empty table with the same structure, engine and partitioning."""
+    client.command(f"CREATE TABLE IF NOT EXISTS {staging_table} AS {table}")
+
+
+def drop_table(client, table: str):
+    client.command(f"DROP TABLE IF EXISTS {table}")
+
+
+def get_partitions(client, table: str) -> list[str]:
+    result = client.query(
+        f"SELECT DISTINCT _partition_id FROM {table} ORDER BY _partition_id"
+    ).result_rows
+    return [row[0] for row in result]
+
+
+def backfill_partitions(
+    client, table: str, staging_table: str, partitions: list[str], date_column: str
+):
+    """Copy the rows of the other days of the partitions into the staging table.
+
+    A partition is replaced as a whole, so the days of a month that are not
+    present in the reloaded file must be taken from the target table. The
+    copy is skipped for the days already in the staging table, which makes
+    it safe to repeat.
+    """
+    for partition in partitions:
+        client.command(
+            f"INSERT INTO {staging_table} SELECT * FROM {table} "
+            f"WHERE _partition_id = '{partition}' AND {date_column} NOT IN "
+            f"(SELECT DISTINCT {date_column} FROM {staging_table} "
+            f"WHERE _partition_id = '{partition}')"
+        )
+
+
+def replace_partitions(client, table: str, staging_table: str, partitions: list[str]):
+    """Atomically swap each partition of the target table with the staging one."""
+    for partition in partitions:
+        client.command(
+            f"ALTER TABLE {table} REPLACE PARTITION ID '{partition}' FROM {staging_table}"
+        )
+
+
+def optimize_partitions(
+    client_factory: Callable,
+    table: str,
+    partitions: list[str],
+    jobs: int = 1,
+    time_budget: float | None = None,
+    cluster: str | None = None,
+) -> tuple[list[str], list[str]]:
+    """Run `OPTIMIZE ... FINAL` only for the given partitions.
+
+    Up to `jobs` partitions are optimized at once, each worker with its own
+    connection made by `client_factory`. No new partition is started after
+    `time_budget` seconds. Returns the optimized and the skipped partitions.
+    With `cluster` the partitions are optimized on all its nodes.
+    """
+    on_cluster = f" ON CLUSTER {cluster}" if cluster else ""
+    deadline = time.monotonic() + time_budget if time_budget else None
+    local = threading.local()
+
+    def optimize(partition: str) -> tuple[str, bool]:
+        if deadline and time.monotonic() >= deadline:
+            return partition, False
+        if not hasattr(local, "client"):
+            local.client = client_factory()
+        if local.client is None:
+            raise ConnectionError("Can't connect to Clickhouse")
+        local.client.command(
+            f"OPTIMIZE TABLE {table}{on_cluster} PARTITION ID '{partition}' FINAL"
+        )
+        return partition, True
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        results = list(executor.map(optimize, partitions))
+
+    optimized = [partition for partition, done in results if done]
+    skipped = [partition for partition, done in results if not done]
+    return optimized, skipped
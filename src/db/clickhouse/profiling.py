@@ -0,0 +1,168 @@
+import math
+
+from db.clickhouse.ddl import LOW_CARDINALITY_FIELDS, base_field_name, strip_nullable
+
+# Distinct values are counted exactly up to this number, then approximately
+EXACT_DISTINCT_LIMIT = 10_000
+
+# A string column with fewer distinct values is worth `LowCardinality`, provided
+# that the values repeat often enough in the sample
+LOW_CARDINALITY_THRESHOLD = 10_000
+LOW_CARDINALITY_MAX_RATIO = 0.1
+
+# How many times the observed maximum must fit into a recommended integer type
+INTEGER_HEADROOM = 2
+
+INTEGER_TYPES = [
+    ("UInt8", 0, 2**8 - 1),
+    ("UInt16", 0, 2**16 - 1),
+    ("UInt32", 0, 2**32 - 1),
+    ("UInt64", 0, 2**64 - 1),
+    ("Int8", -(2**7), 2**7 - 1),
+    ("Int16", -(2**15), 2**15 - 1),
+    ("Int32", -(2**31), 2**31 - 1),
+    ("Int64", -(2**63), 2**63 - 1),
+]
+
+
+class HyperLogLog:
+    """Approximate distinct counter with a fixed memory footprint.
+
+    2**precision one-byte registers; the standard error is about
+    1.04 / sqrt(2**precision), i.e. 1.6% for the default precision.
+    """
+
+    def __init__(self, precision: int = 12):
+        self.precision = precision
+        self.num_registers = 1 << precision
+        self.registers = bytearray(self.num_registers)
+        self.alpha = 0.7213 / (1 + 1.079 / self.num_registers)
+
+    def add(self, value: str):
+        hashed = hash(value) & 0xFFFFFFFFFFFFFFFF
+        index = hashed & (self.num_registers - 1)
+        rest = hashed >> self.precision
+        rank = (64 - self.precision) - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def count(self) -> int:
+        estimate = self.alpha * self.num_registers**2
+        estimate /= sum(2.0**-register for register in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * self.num_registers and zeros:
+            estimate = self.num_registers * math.log(self.num_registers / zeros)
+        return int(estimate)
+
+
+class DistinctCounter:
+    """Exact counting for small cardinalities, switches to HyperLogLog on overflow."""
+
+    def __init__(self, exact_limit: int = EXACT_DISTINCT_LIMIT):
+        self.exact_limit = exact_limit
+        self.values: set[str] | None = set()
+        self.hll: HyperLogLog | None = None
+
+    def add(self, value: str):
+        if self.values is not None:
+            self.values.add(value)
+            if len(self.values) <= self.exact_limit:
+                return
+            self.hll = HyperLogLog()
+            for seen_value in self.values:
+                self.hll.add(seen_value)
+            self.values = None
+        self.hll.add(value)
+
+    @property
+    def is_exact(self) -> bool:
+        return self.values is not None
+
+    def count(self) -> int:
+        if self.values is not None:
+            return len(self.values)
+        return self.hll.count()
+
+
+class ColumnProfile:
+    def __init__(self, field: str, column_type: str):
+        self.field = field
+        self.column_type = column_type
+        self.base_type = strip_nullable(column_type)
+        self.is_numeric = self.base_type.startswith(("UInt", "Int", "Float"))
+        self.rows = 0
+        self.nulls = 0
+        self.distinct = DistinctCounter()
+        self.min_value: float | None = None
+        self.max_value: float | None = None
+        self.min_length: int | None = None
+        self.max_length = 0
+        self.total_length = 0
+
+    def add(self, value: str):
+        self.rows += 1
+        if value == "":
+            self.nulls += 1
+            return
+
+        self.distinct.add(value)
+        length = len(value)
+        self.total_length += length
+        self.max_length = max(self.max_length, length)
+        if self.min_length is None or length < self.min_length:
+            self.min_length = length
+
+        if self.is_numeric:
+            try:
+                number = float(value) if self.base_type.startswith("Float") else int(value)
+            except ValueError:
+                return
+            if self.min_value is None or number < self.min_value:
+                self.min_value = number
+            if self.max_value is None or number > self.max_value:
+                self.max_value = number
+
+    @property
+    def null_rate(self) -> float:
+        return self.nulls / self.rows if self.rows else 0.0
+
+    @property
+    def avg_length(self) -> float:
+        non_null = self.rows - self.nulls
+        return self.total_length / non_null if non_null else 0.0
+
+    def _integer_type(self) -> str:
+        low = self.min_value * INTEGER_HEADROOM if self.min_value < 0 else 0
+        high = self.max_value * INTEGER_HEADROOM
+        for type_name, type_min, type_max in INTEGER_TYPES:
+            if type_min <= low and high <= type_max:
+                return type_name
+        return self.base_type
+
+    def recommend_type(self) -> str:
+        """Narrowest type that fits the observed values.
+
+        Arrays, dates and floats keep their types. `Nullable` is dropped from
+        strings (the importer writes an empty string for an empty value) and
+        from other columns without empty values in the sample.
+        """
+        if self.base_type.startswith("Array") or self.rows == 0:
+            return self.column_type
+
+        if self.base_type == "String":
+            distinct = self.distinct.count()
+            non_null = self.rows - self.nulls
+            if base_field_name(self.field) in LOW_CARDINALITY_FIELDS or (
+                distinct < LOW_CARDINALITY_THRESHOLD
+                and distinct <= non_null * LOW_CARDINALITY_MAX_RATIO
+            ):
+                return "LowCardinality(String)"
+            return "String"
+
+        recommended = self.base_type
+        if self.base_type.startswith(("UInt", "Int")) and self.max_value is not None:
+            recommended = self._integer_type()
+
+        if self.nulls > 0:
+            return f"Nullable({recommended})"
+        return recommended
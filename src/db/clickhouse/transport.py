@@ -0,0 +1,114 @@
+import threading
+
+TRANSPORTS = ["http", "native"]
+COMPRESSIONS = ["none", "lz4", "zstd"]
+
+# HTTP connections are pooled per process, so the clients of concurrent
+# imports reuse them. Pool size -> pool manager
+_pool_managers = {}
+_pool_managers_lock = threading.Lock()
+
+
+class QueryResult:
+    def __init__(self, result_rows: list):
+        self.result_rows = result_rows
+
+
+class NativeClient:
+    """Client of the native TCP protocol with the interface of `clickhouse_connect`.
+
+    Only the methods used by the scripts are provided. Inserts are sent as
+    compressed columnar blocks. Requires the `clickhouse-driver` package, and
+    `clickhouse-cityhash` with `lz4` or `zstd` for compression.
+    """
+
+    def __init__(self, host: str, port: int, user: str, password: str, **options):
+        from clickhouse_driver import Client
+
+        self.client = Client(host=host, port=port, user=user, password=password, **options)
+        # Fail early as `clickhouse_connect` does, the driver connects lazily
+        self.client.execute("SELECT 1")
+
+    def command(self, query: str):
+        return self.client.execute(query)
+
+    def query(self, query: str) -> QueryResult:
+        return QueryResult(self.client.execute(query))
+
+    def insert(
+        self,
+        table: str,
+        data: list[list],
+        column_names: list[str],
+        settings: dict | None = None,
+    ):
+        columns = [list(column) for column in zip(*data)]
+        quoted_columns = ", ".join(f"`{column}`" for column in column_names)
+        self.client.execute(
+            f"INSERT INTO {table} ({quoted_columns}) VALUES",
+            columns,
+            columnar=True,
+            settings=settings,
+        )
+
+    def close(self):
+        self.client.disconnect()
+
+
+def shared_pool_manager(pool_size: int):
+    from clickhouse_connect.driver.httputil import get_pool_manager
+
+    with _pool_managers_lock:
+        if pool_size not in _pool_managers:
+            # One pool per host, e.g. for the shards of a cluster
+            _pool_managers[pool_size] = get_pool_manager(maxsize=pool_size, num_pools=8)
+        return _pool_managers[pool_size]
+
+
+def get_client(
+    host: str,
+    port: int,
+    user: str,
+    password: str,
+    transport: str = "http",
+    compression: str = "lz4",
+    pool_size: int = 8,
+    connect_timeout: float = 10,
+    send_receive_timeout: float = 300,
+    settings: dict | None = None,
+):
+    """Client of either transport with the same interface.
+
+    `settings` are applied to every query of the client.
+    """
+    if transport not in TRANSPORTS:
+        raise ValueError(f"Unknown transport: {transport}")
+    if compression not in COMPRESSIONS:
+        raise ValueError(f"Unknown compression: {compression}")
+
+    if transport == "native":
+        return NativeClient(
+            host=host,
+            port=port,
+            user=user,
+            password=password,
+            compression=compression if compression != "none" else False,
+            connect_timeout=connect_timeout,
+            send_receive_timeout=send_receive_timeout,
+            settings=settings or {},
+        )
+
+    import clickhouse_connect
+
+    return clickhouse_connect.get_client(
+        host=host,
+        port=port,
+        username=user,
+        password=password,
+        # Inserts are sent in the columnar Native format, compressed as a whole
+        compress=compression if compression != "none" else False,
+        pool_mgr=shared_pool_manager(pool_size),
+        connect_timeout=connect_timeout,
+        send_receive_timeout=send_receive_timeout,
+        settings=settings or {},
+    )
@@ -270,4 +270,8 @@ columns_types = {
     "ym:pv:shareTitle": "Nullable(String)",
 }
 
-columns_types = populate_with_attribution(columns_types, ATTRIBUTION_RENAMING_MAPPING)
+# Field names with `<attr>` are kept for the field registry (`utils.fields`)
+columns_types_templates = columns_types
+columns_types = populate_with_attribution(
+    columns_types_templates, ATTRIBUTION_RENAMING_MAPPING
+)
@@ -0,0 +1,112 @@
+import os
+import threading
+from dataclasses import dataclass
+from datetime import date
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Iterator
+
+from logs_api.logs_api import LogsAPI, OperationResult
+from utils.utils import DECOMPRESSORS, RateLimiter
+
+# Processed reports are cleaned, the ones still in the queue are canceled.
+# Reports in the other statuses have nothing to delete
+CLEANABLE_STATUSES = ("processed",)
+CANCELABLE_STATUSES = ("created", "awaiting_retry")
+
+
+def downloaded_basenames(report: dict) -> list[str]:
+    """Default names of the report saved by `download_logs.py`, without extension.
+
+    With several sources (`-s visits -s hits`) the name includes the source,
+    with `--partition-by` it is a directory of partitions.
+    """
+    counter_id, date1, date2 = report["counter_id"], report["date1"], report["date2"]
+    names = [f"{counter_id}_{date1}_{date2}"]
+    if report.get("source"):
+        names.append(f"{counter_id}_{report['source']}_{date1}_{date2}")
+    return names
+
+
+def has_partitions(directory: str) -> bool:
+    """The directory has `key=value` partitions written by `--partition-by`."""
+    return any(
+        entry.is_dir() and "=" in entry.name and os.listdir(entry.path)
+        for entry in os.scandir(directory)
+    )
+
+
+@dataclass
+class ReportFilter:
+    statuses: list[str] | None = None
+    # The end of the report period is at least that many days ago
+    older_than_days: int | None = None
+    # The report period is within the range
+    from_date: date | None = None
+    to_date: date | None = None
+    min_size: int | None = None
+    # The report has been saved to this directory, possibly compressed
+    downloaded_dir: str | None = None
+
+    def is_downloaded(self, report: dict) -> bool:
+        for name in downloaded_basenames(report):
+            fname = os.path.join(self.downloaded_dir, name)
+            if any(os.path.exists(f"{fname}.tsv{ext}") for ext in ["", *DECOMPRESSORS]):
+                return True
+            if os.path.isdir(fname) and has_partitions(fname):
+                return True
+        return False
+
+    def matches(self, report: dict, today: date | None = None) -> bool:
+        date1 = date.fromisoformat(report["date1"])
+        date2 = date.fromisoformat(report["date2"])
+        if self.statuses and report["status"] not in self.statuses:
+            return False
+        if self.older_than_days is not None:
+            if ((today or date.today()) - date2).days < self.older_than_days:
+                return False
+        if self.from_date and date1 < self.from_date:
+            return False
+        if self.to_date and date2 > self.to_date:
+            return False
+        if self.min_size and report["size"] < self.min_size:
+            return False
+        if self.downloaded_dir and not self.is_downloaded(report):
+            return False
+        return True
+
+
+def is_deletable(report: dict) -> bool:
+    return report["status"] in CLEANABLE_STATUSES + CANCELABLE_STATUSES
+
+
+def delete_report(ym: LogsAPI, report: dict) -> OperationResult:
+    if report["status"] in CANCELABLE_STATUSES:
+        return ym.cancel_report(report["request_id"])
+    return ym.delete_report(report["request_id"])
+
+
+def delete_reports(
+    api_factory: Callable[[], LogsAPI],
+    reports: list[dict],
+    jobs: int = 1,
+    rate: float | None = None,
+) -> Iterator[tuple[dict, OperationResult]]:
+    """Delete reports concurrently, yielding the results as they complete.
+
+    Up to `jobs` requests are made at once, each worker with its own client
+    made by `api_factory`, and no more than `rate` requests per second are
+    started in total.
+    """
+    limiter = RateLimiter(rate)
+    local = threading.local()
+
+    def delete(report: dict) -> tuple[dict, OperationResult]:
+        if not hasattr(local, "ym"):
+            local.ym = api_factory()
+        limiter.wait()
+        return report, delete_report(local.ym, report)
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = [executor.submit(delete, report) for report in reports]
+        for future in as_completed(futures):
+            yield future.result()
@@ -1,8 +1,12 @@
+import time
+import functools
 from typing import Any
 from dataclasses import dataclass
 
 from tapi_yandex_metrika import YandexMetrikaLogsapi
 
+from utils.metrics import METRICS, api_call
+
 
 @dataclass
 class OperationResult:
@@ -10,6 +14,28 @@ class OperationResult:
     error: Exception | None = None
 
 
+def measured(method):
+    """Record the latency and the outcome of an API call."""
+    name = method.__name__
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        api_call.method = name
+        started_at = time.monotonic()
+        outcome = "error"
+        try:
+            result = method(self, *args, **kwargs)
+            if not isinstance(result, OperationResult) or result.success:
+                outcome = "ok"
+            return result
+        finally:
+            api_call.method = None
+            METRICS.observe("api_request_seconds", time.monotonic() - started_at, method=name)
+            METRICS.add("api_requests", method=name, outcome=outcome)
+
+    return wrapper
+
+
 class LogsAPI:
 
     def __init__(
@@ -41,12 +67,14 @@ class LogsAPI:
 
         self.params.update(params)
 
+    @measured
     def create_report(self, params: dict[str, Any] = {}) -> int:
         result = self.client.create().post(params=self.params | params)
         request_id = result["log_request"]["request_id"]
 
         return request_id
 
+    @measured
     def check_reporting_capability(
         self, params: dict[str, Any] = {}
     ) -> OperationResult:
@@ -56,9 +84,11 @@ class LogsAPI:
         except Exception as e:
             return OperationResult(False, e)
 
+    @measured
     def get_report_info(self, request_id: int):
         return self.client.info(requestId=request_id).get()
 
+    @measured
     def get_all_reports_info(self):
         return self.client.allinfo().get()
 
@@ -66,12 +96,22 @@ class LogsAPI:
         info = self.get_report_info(request_id)
         return info["log_request"]["status"] == "processed"
 
+    @measured
     def download_report_part(self, request_id: int, part_num: int):
         return self.client.download(requestId=request_id, partNumber=part_num).get()
 
+    @measured
     def delete_report(self, request_id: int) -> OperationResult:
         try:
             self.client.clean(requestId=request_id).post()
             return OperationResult(True)
         except Exception as e:
             return OperationResult(False, e)
+
+    @measured
+    def cancel_report(self, request_id: int) -> OperationResult:
+        try:
+            self.client.cancel(requestId=request_id).post()
+            return OperationResult(True)
+        except Exception as e:
+            return OperationResult(False, e)
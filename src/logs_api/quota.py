@@ -0,0 +1,39 @@
+from datetime import date
+from statistics import median
+
+# The data of processed reports is stored on the server until they are cleaned
+STORED_STATUSES = ("processed",)
+# Reports in the queue have no size yet, but will take space soon
+QUEUED_STATUSES = ("created", "awaiting_retry")
+
+
+def report_days(report: dict) -> int:
+    date1 = date.fromisoformat(report["date1"])
+    date2 = date.fromisoformat(report["date2"])
+    return (date2 - date1).days + 1
+
+
+def bytes_per_day(reports: list[dict], source: str) -> float:
+    """Median size of one day of data in the processed reports of the source."""
+    sizes = [
+        report["size"] / report_days(report)
+        for report in reports
+        if report["status"] in STORED_STATUSES and report["source"] == source
+    ]
+    return median(sizes) if sizes else 0
+
+
+def estimate_report_size(reports: list[dict], source: str, days: int) -> int:
+    """Expected size of a new report, judging by the existing ones."""
+    return int(bytes_per_day(reports, source) * days)
+
+
+def used_quota(reports: list[dict]) -> int:
+    """Space taken by the stored reports plus the expected size of the queued ones."""
+    used = 0
+    for report in reports:
+        if report["status"] in STORED_STATUSES:
+            used += report["size"]
+        elif report["status"] in QUEUED_STATUSES:
+            used += estimate_report_size(reports, report["source"], report_days(report))
+    return used
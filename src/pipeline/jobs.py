@@ -0,0 +1,146 @@
+"""Persistent queue of the jobs of the ingestion daemon.
+
+A job is a report of one counter and source for a date range, which goes
+through the statuses in `STATUSES` one stage at a time. The store is a SQLite
+database, so the daemon resumes every job from its last completed stage
+after a restart.
+"""
+
+import sqlite3
+import time
+from contextlib import closing
+from dataclasses import dataclass, fields
+
+# The status of a job is the last stage it has completed
+STATUSES = ["new", "ordered", "processed", "downloaded", "imported", "cleaned"]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY,
+    counter_id INTEGER NOT NULL,
+    source TEXT NOT NULL,
+    date1 TEXT NOT NULL,
+    date2 TEXT NOT NULL,
+    table_name TEXT NOT NULL,
+    renamed_fields INTEGER NOT NULL DEFAULT 0,
+    status TEXT NOT NULL DEFAULT 'new',
+    request_id INTEGER,
+    file TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    failed INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    UNIQUE (counter_id, source, date1, date2, table_name)
+)
+"""
+
+
+@dataclass
+class Job:
+    id: int
+    counter_id: int
+    source: str
+    date1: str
+    date2: str
+    table_name: str
+    renamed_fields: bool
+    status: str
+    request_id: int | None
+    file: str | None
+    attempts: int
+    error: str | None
+    # Out of attempts, the job stays at its status until it is retried by hand
+    failed: bool
+    next_attempt_at: float
+    created_at: float
+    updated_at: float
+
+
+JOB_COLUMNS = ", ".join(field.name for field in fields(Job))
+
+
+class JobStore:
+    """Every call uses its own connection, so the store can be shared by threads."""
+
+    def __init__(self, path: str):
+        self.path = path
+        with closing(self.connect()) as connection, connection:
+            connection.execute(SCHEMA)
+
+    def connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.path, timeout=30)
+        connection.execute("PRAGMA journal_mode = WAL")
+        return connection
+
+    def add(
+        self,
+        counter_id: int,
+        source: str,
+        date1: str,
+        date2: str,
+        table_name: str,
+        renamed_fields: bool = False,
+    ) -> bool:
+        """Add a job unless the same one exists, returns whether it was added."""
+        now = time.time()
+        with closing(self.connect()) as connection, connection:
+            cursor = connection.execute(
+                "INSERT OR IGNORE INTO jobs (counter_id, source, date1, date2, "
+                "table_name, renamed_fields, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (counter_id, source, date1, date2, table_name, renamed_fields, now, now),
+            )
+            return cursor.rowcount > 0
+
+    def select(self, where: str = "", params: tuple = ()) -> list[Job]:
+        query = f"SELECT {JOB_COLUMNS} FROM jobs"
+        if where:
+            query += f" WHERE {where}"
+        with closing(self.connect()) as connection:
+            rows = connection.execute(query + " ORDER BY id", params).fetchall()
+        return [Job(*row) for row in rows]
+
+    def get(self, job_id: int) -> Job | None:
+        jobs = self.select("id = ?", (job_id,))
+        return jobs[0] if jobs else None
+
+    def due(self, status: str, limit: int, exclude: set[int]) -> list[Job]:
+        """Jobs ready for the stage after `status`, oldest first."""
+        jobs = self.select(
+            "status = ? AND NOT failed AND next_attempt_at <= ?", (status, time.time())
+        )
+        return [job for job in jobs if job.id not in exclude][:limit]
+
+    def update(self, job_id: int, **values):
+        values["updated_at"] = time.time()
+        assignments = ", ".join(f"{column} = ?" for column in values)
+        with closing(self.connect()) as connection, connection:
+            connection.execute(
+                f"UPDATE jobs SET {assignments} WHERE id = ?", [*values.values(), job_id]
+            )
+
+    def advance(self, job: Job, status: str, **values):
+        """Record a completed stage, resetting the failures of the previous one."""
+        self.update(job.id, status=status, attempts=0, error=None, next_attempt_at=0, **values)
+
+    def postpone(self, job: Job, delay: float):
+        """Try the stage again later, without counting it as a failure."""
+        self.update(job.id, next_attempt_at=time.time() + delay)
+
+    def fail(self, job: Job, error: str, max_attempts: int, retry_delay: float):
+        """Record a failed attempt, the job is retried later with a growing delay."""
+        attempts = job.attempts + 1
+        delay = min(retry_delay * 2 ** (attempts - 1), 3600)
+        self.update(
+            job.id,
+            attempts=attempts,
+            error=error,
+            failed=attempts >= max_attempts,
+            next_attempt_at=time.time() + delay,
+        )
+
+    def retry(self, job_id: int):
+        """Give a failed job a new series of attempts."""
+        self.update(job_id, attempts=0, failed=False, next_attempt_at=0)
@@ -0,0 +1,127 @@
+"""Date-partitioned output of downloaded reports.
+
+Rows are split by day or by month into a Hive-style layout, one file per
+partition, so that partitions can be loaded in parallel and replaced
+independently:
+
+    1_2025-01-01_2025-01-31/month=202501/data.tsv.gz
+    1_2025-01-01_2025-01-31/date=2025-01-01/data.parquet
+"""
+
+import os
+import bz2
+import gzip
+import lzma
+import datetime as dt
+
+PARTITION_KEYS = ["date", "month"]
+FORMATS = ["tsv", "parquet"]
+
+# Compression of TSV files, the same ones `clickhouse.py` reads
+TSV_COMPRESSORS = {
+    "gzip": (".gz", gzip.open),
+    "bz2": (".bz2", bz2.open),
+    "xz": (".xz", lzma.open),
+}
+# Compression codecs of Parquet files
+PARQUET_COMPRESSIONS = ["snappy", "gzip", "zstd"]
+
+FILE_NAME = "data"
+
+
+def partition_value(date: str, key: str) -> str:
+    """Partition of a `YYYY-MM-DD` date: the date itself or `toYYYYMM()` of it."""
+    return date if key == "date" else date[:4] + date[5:7]
+
+
+def partition_values(date1: str, date2: str, key: str) -> list[str]:
+    start = dt.date.fromisoformat(date1)
+    days = (dt.date.fromisoformat(date2) - start).days + 1
+    dates = [(start + dt.timedelta(days=day)).isoformat() for day in range(days)]
+    return list(dict.fromkeys(partition_value(date, key) for date in dates))
+
+
+def file_extension(fmt: str, compression: str | None) -> str:
+    if fmt == "parquet":
+        return ".parquet"
+    return ".tsv" + (TSV_COMPRESSORS[compression][0] if compression else "")
+
+
+def check_compression(fmt: str, compression: str | None):
+    allowed = PARQUET_COMPRESSIONS if fmt == "parquet" else list(TSV_COMPRESSORS)
+    if compression and compression not in allowed:
+        raise ValueError(f"{fmt} files can be compressed with: {', '.join(allowed)}")
+
+
+class PartitionedWriter:
+    """Streams DataFrames of raw values into one file per partition.
+
+    The file of a partition is opened on its first rows and kept open until
+    `close()`, which also syncs the files to disk.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        date_column: str,
+        key: str = "date",
+        fmt: str = "tsv",
+        compression: str | None = None,
+    ):
+        check_compression(fmt, compression)
+        if fmt == "parquet":
+            try:
+                import pyarrow  # noqa: F401
+            except ImportError:
+                raise RuntimeError("The `pyarrow` package is required: pip install pyarrow")
+        self.directory = directory
+        self.date_column = date_column
+        self.key = key
+        self.fmt = fmt
+        self.compression = compression
+        # Partition value -> open file (TSV) or ParquetWriter
+        self.writers = {}
+        self.fnames = {}
+
+    def partition_fname(self, value: str) -> str:
+        fname = FILE_NAME + file_extension(self.fmt, self.compression)
+        return os.path.join(self.directory, f"{self.key}={value}", fname)
+
+    def open_writer(self, value: str, df):
+        fname = self.partition_fname(value)
+        os.makedirs(os.path.dirname(fname), exist_ok=True)
+        self.fnames[value] = fname
+        if self.fmt == "parquet":
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+
+            schema = pa.Schema.from_pandas(df, preserve_index=False)
+            return pq.ParquetWriter(fname, schema, compression=self.compression or "snappy")
+        if self.compression:
+            return TSV_COMPRESSORS[self.compression][1](fname, "wt", newline="")
+        return open(fname, "w", newline="")
+
+    def write(self, df):
+        values = df[self.date_column].str[:10]
+        if self.key == "month":
+            values = values.str[:4] + values.str[5:7]
+        for value, group in df.groupby(values, sort=False):
+            writer = self.writers.get(value)
+            is_new = writer is None
+            if is_new:
+                writer = self.writers[value] = self.open_writer(value, group)
+            if self.fmt == "parquet":
+                import pyarrow as pa
+
+                writer.write_table(pa.Table.from_pandas(group, preserve_index=False))
+            else:
+                group.to_csv(writer, sep="\t", index=False, header=is_new)
+
+    def close(self) -> list[str]:
+        """Close and sync the files, return their names."""
+        for value, writer in self.writers.items():
+            writer.close()
+            with open(self.fnames[value], "rb") as f:
+                os.fsync(f.fileno())
+        self.writers = {}
+        return sorted(self.fnames.values())
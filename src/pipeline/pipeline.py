@@ -0,0 +1,248 @@
+"""Streaming building blocks of the download and import pipeline.
+
+The scripts are thin wrappers around these functions; other code (e.g. an
+Airflow task) can use them to move data in-process without intermediate
+files:
+
+    ym = LogsAPI(auth_token, counter_id, fields, start_date, end_date, source)
+    request_id = find_report(ym) or order_report(ym)
+    wait_for_report(ym, request_id)
+    rows = iter_report_rows(ym, request_id)
+    typed_rows = iter_typed_rows(rows, column_types)
+    with DuckDBSink("local.duckdb", "visits") as sink:
+        sink.open(columns, column_types)
+        write_batches(sink, iter_row_batches(typed_rows, 10_000))
+
+The sinks (Clickhouse, TSV, SQLite, DuckDB) are in `pipeline.sinks`.
+"""
+
+import csv
+import time
+from dataclasses import dataclass
+from typing import Callable, Iterable, Iterator
+
+from db.clickhouse.batching import BatchPolicy, estimate_row_size
+from db.clickhouse.convert import make_row_converter, string_interner
+from db.clickhouse.ddl import is_low_cardinality
+from logs_api.logs_api import LogsAPI, OperationResult
+from logs_api.quota import used_quota
+from utils.metrics import METRICS
+
+# Statuses of requests that have or will have data to download
+ACTIVE_REPORT_STATUSES = ("created", "processed", "awaiting_retry")
+
+
+@dataclass
+class ReportPart:
+    # Sequence number of the part in the report, starting from 1
+    number: int
+    # Part number as assigned by the API
+    part_number: int
+    columns: list[str]
+    rows: list[list[str]]
+
+
+@dataclass
+class RowBatch:
+    # Converted rows
+    rows: list[list]
+    # Estimated size of the raw rows in bytes
+    size: int
+    # Number of the last row of the batch in the file, excluding the header
+    last_row: int
+    # When reading and converting the rows of the batch started
+    started_at: float
+
+
+def find_report(ym: LogsAPI) -> int | None:
+    """ID of an existing request with the same parameters as `ym`, if any.
+
+    Lets a retried run pick up the report it has already ordered instead of
+    queueing a new one.
+    """
+    params = ym.params
+    for report in ym.get_all_reports_info()["requests"]:
+        if report["status"] not in ACTIVE_REPORT_STATUSES:
+            continue
+        if (
+            report["date1"] == params.get("date1")
+            and report["date2"] == params.get("date2")
+            and report["source"] == params.get("source")
+            and report["attribution"].lower() == params.get("attribution", "").lower()
+            and set(report["fields"]) == set(params.get("fields", []))
+        ):
+            return report["request_id"]
+    return None
+
+
+def order_report(ym: LogsAPI) -> int:
+    with METRICS.stage("order"):
+        return ym.create_report()
+
+
+def wait_for_quota(
+    ym: LogsAPI,
+    quota: int,
+    size: int,
+    interval: float = 60,
+    on_wait: Callable[[int], None] | None = None,
+) -> int:
+    """Block until `size` bytes of the storage quota are free, return the free space.
+
+    Doesn't wait if there are no other reports: a report larger than the
+    whole quota would never fit otherwise. `on_wait` is called with the free
+    space before each sleep.
+    """
+    while True:
+        used = used_quota(ym.get_all_reports_info()["requests"])
+        if used == 0 or quota - used >= size:
+            return quota - used
+        if on_wait:
+            on_wait(quota - used)
+        time.sleep(interval)
+
+
+def wait_for_report(
+    ym: LogsAPI,
+    request_id: int,
+    interval: float = 10,
+    on_wait: Callable[[float], None] | None = None,
+) -> dict:
+    """Block until the report is processed and return its `log_request` info.
+
+    `on_wait` is called with the seconds waited so far before each sleep.
+    """
+    waited = 0.0
+    with METRICS.stage("queue_wait"):
+        while True:
+            info = ym.get_report_info(request_id)["log_request"]
+            if info["status"] == "processed":
+                return info
+            if on_wait:
+                on_wait(waited)
+            time.sleep(interval)
+            waited += interval
+
+
+def parse_part(text: str) -> tuple[list[str], list[list[str]]]:
+    """Split the TSV text of a downloaded part into the header and rows.
+
+    The repeated values of low-cardinality columns share one string object.
+    """
+    lines = text.split("\n")
+    columns = lines[0].split("\t")
+    rows = [line.split("\t") for line in lines[1:] if line]
+    for idx, column in enumerate(columns):
+        if is_low_cardinality(column):
+            intern = string_interner()
+            for row in rows:
+                row[idx] = intern(row[idx])
+    return columns, rows
+
+
+def iter_report_parts(
+    ym: LogsAPI, request_id: int, info: dict | None = None
+) -> Iterator[ReportPart]:
+    """Download the parts of a processed report one by one."""
+    if info is None:
+        info = ym.get_report_info(request_id)["log_request"]
+    for number, part_info in enumerate(info["parts"], start=1):
+        part_number = part_info["part_number"]
+        with METRICS.stage("download") as stage:
+            part = ym.download_report_part(request_id, part_number)
+            stage.bytes += len(part.data)
+        with METRICS.stage("parse") as stage:
+            columns, rows = parse_part(part.data)
+            stage.rows += len(rows)
+        yield ReportPart(number, part_number, columns, rows)
+
+
+def iter_report_rows(
+    ym: LogsAPI, request_id: int, info: dict | None = None
+) -> Iterator[list[str]]:
+    """Raw rows of all parts of a report, without headers."""
+    for part in iter_report_parts(ym, request_id, info):
+        yield from part.rows
+
+
+def clean_report(ym: LogsAPI, request_id: int) -> OperationResult:
+    """Delete the data of a report from the server to free the storage quota.
+
+    Call it only when all the parts are stored or committed.
+    """
+    return ym.delete_report(request_id)
+
+
+def iter_tsv_rows(f: Iterable[str]) -> tuple[list[str], Iterator[list[str]]]:
+    """Header and raw rows of a TSV file written by `download_logs.py`."""
+    reader = csv.reader(f, delimiter="\t")
+    return next(reader), reader
+
+
+def iter_typed_rows(
+    rows: Iterable[list[str]], column_types: list[str]
+) -> Iterator[list]:
+    """Convert raw values to Python values according to the Clickhouse types."""
+    return map(make_row_converter(column_types), rows)
+
+
+def iter_row_batches(rows: Iterable[list], batch_size: int) -> Iterator[list[list]]:
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def iter_policy_batches(
+    rows: Iterable[list[str]],
+    convert_row: Callable[[list[str]], list],
+    batch_policy: BatchPolicy,
+    row_num: int = 0,
+    first_batch_end: int = 0,
+) -> Iterator[RowBatch]:
+    """Convert raw rows and split them into batches as the batch policy decides.
+
+    `row_num` is the number of rows before `rows`, e.g. the ones skipped on
+    resume. If `first_batch_end` is set, the first batch ends at that row
+    whatever the policy says, to repeat a batch with the same boundaries.
+    """
+    batch = []
+    size = 0
+    started_at = time.monotonic()
+    for row in rows:
+        batch.append(convert_row(row))
+        size += estimate_row_size(row)
+        row_num += 1
+        if first_batch_end:
+            is_full = row_num >= first_batch_end
+        else:
+            is_full = batch_policy.is_full(len(batch), size)
+        if is_full:
+            yield RowBatch(batch, size, row_num, started_at)
+            batch = []
+            size = 0
+            first_batch_end = 0
+            started_at = time.monotonic()
+    if batch:
+        yield RowBatch(batch, size, row_num, started_at)
+
+
+def iter_column_batches(
+    rows: Iterable[list], batch_size: int
+) -> Iterator[list[list]]:
+    """Same as `iter_row_batches`, but every batch is a list of columns."""
+    for batch in iter_row_batches(rows, batch_size):
+        yield [list(column) for column in zip(*batch)]
+
+
+def write_tsv(fname: str, columns: list[str], rows: Iterable[list], append: bool = False):
+    """Write rows in the same TSV dialect as the downloaded reports."""
+    with open(fname, "a" if append else "w", newline="") as f:
+        writer = csv.writer(f, delimiter="\t", lineterminator="\n")
+        if not append:
+            writer.writerow(columns)
+        writer.writerows(rows)
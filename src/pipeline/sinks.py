@@ -0,0 +1,325 @@
+import csv
+import json
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
+from typing import Callable, Iterable
+
+from db.clickhouse.cluster import Shard, ShardRouter
+from db.clickhouse.convert import escape
+from db.clickhouse.ddl import strip_low_cardinality, strip_nullable
+
+
+class Sink:
+    """Destination of typed row batches.
+
+    Every sink receives the rows converted by the same code
+    (`db.clickhouse.convert`), driven by the Clickhouse types of the columns
+    (`columns_types`). Sinks are context managers:
+
+        with SqliteSink("local.db", "visits") as sink:
+            sink.open(columns, column_types)
+            for batch in batches:
+                sink.write_batch(batch)
+    """
+
+    def open(self, columns: list[str], column_types: list[str]):
+        self.columns = columns
+        self.column_types = column_types
+
+    def write_batch(self, batch: list[list]):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class ClickhouseSink(Sink):
+    def __init__(self, client, table: str, settings: dict | None = None):
+        self.client = client
+        self.table = table
+        self.settings = settings or {}
+
+    def write_batch(self, batch: list[list], settings: dict | None = None):
+        self.client.insert(
+            self.table,
+            batch,
+            column_names=self.columns,
+            settings=self.settings | (settings or {}),
+        )
+
+
+class ShardedClickhouseSink(Sink):
+    """Local tables of a cluster, each batch is inserted into the shards directly.
+
+    Rows are routed by `cityHash64(key_column)` as the `Distributed` table
+    does, and the parts of a batch are inserted into the shards in parallel,
+    each shard with its own connection made by `client_factory(host)`.
+    """
+
+    def __init__(
+        self,
+        client_factory: Callable,
+        shards: list[Shard],
+        table: str,
+        key_column: str,
+        settings: dict | None = None,
+    ):
+        self.shards = shards
+        self.table = table
+        self.key_column = key_column
+        self.settings = settings or {}
+        self.clients = {}
+        for shard in shards:
+            client = client_factory(shard.host)
+            if client is None:
+                raise ConnectionError(f"Can't connect to shard {shard.num}: {shard.host}")
+            self.clients[shard.num] = client
+        self.executor = ThreadPoolExecutor(max_workers=len(shards))
+
+    def open(self, columns: list[str], column_types: list[str]):
+        super().open(columns, column_types)
+        if self.key_column not in columns:
+            raise ValueError(f"No sharding key column `{self.key_column}` in the data")
+        self.router = ShardRouter(self.shards, columns.index(self.key_column))
+
+    def write_batch(self, batch: list[list], settings: dict | None = None):
+        settings = self.settings | (settings or {})
+        futures = []
+        for shard_num, rows in self.router.split(batch).items():
+            shard_settings = dict(settings)
+            if "insert_deduplication_token" in shard_settings:
+                shard_settings["insert_deduplication_token"] += f":{shard_num}"
+            futures.append(
+                self.executor.submit(
+                    self.clients[shard_num].insert,
+                    self.table,
+                    rows,
+                    column_names=self.columns,
+                    settings=shard_settings,
+                )
+            )
+        for future in futures:
+            future.result()
+
+    def close(self):
+        self.executor.shutdown()
+        for client in self.clients.values():
+            client.close()
+
+
+class TsvSink(Sink):
+    """TSV file in the same dialect as the files written by `download_logs.py`."""
+
+    def __init__(self, fname: str, append: bool = False):
+        self.fname = fname
+        self.append = append
+        self.f = None
+
+    def open(self, columns: list[str], column_types: list[str]):
+        super().open(columns, column_types)
+        self.f = open(self.fname, "a" if self.append else "w", newline="")
+        self.writer = csv.writer(self.f, delimiter="\t", lineterminator="\n")
+        if not self.append:
+            self.writer.writerow(columns)
+
+    def write_batch(self, batch: list[list]):
+        quoted = [_is_quoted_array(column_type) for column_type in self.column_types]
+        self.writer.writerows(
+            [[_to_tsv_value(value, q) for value, q in zip(row, quoted)] for row in batch]
+        )
+
+    def close(self):
+        if self.f:
+            self.f.close()
+
+
+def _is_quoted_array(column_type: str) -> bool:
+    """The Logs API quotes the elements of arrays of strings and timestamps."""
+    return column_type.startswith("Array") and "Int" not in column_type and "Float" not in column_type
+
+
+def _to_tsv_value(value, quoted: bool = False) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, list):
+        if quoted:
+            return "[" + ",".join(f"'{escape(_to_tsv_value(item))}'" for item in value) + "]"
+        return "[" + ",".join(_to_tsv_value(item) for item in value) + "]"
+    if isinstance(value, datetime):
+        return value.strftime("%Y-%m-%d %H:%M:%S")
+    return str(value)
+
+
+SQLITE_TYPES = {
+    # IDs don't fit into signed 64-bit SQLite integers
+    "UInt64": "TEXT",
+    "UInt": "INTEGER",
+    "Int": "INTEGER",
+    "Float": "REAL",
+    "Date": "TEXT",
+    "String": "TEXT",
+    "LowCardinality": "TEXT",
+}
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat(sep=" ")
+    if isinstance(value, date):
+        return value.isoformat()
+    raise TypeError(f"Can't serialize {type(value)}")
+
+
+class SqliteSink(Sink):
+    """Table in a local SQLite database, created on the first write if missing.
+
+    Dates and UInt64 IDs are stored as strings, arrays as JSON.
+    """
+
+    def __init__(self, path: str, table: str):
+        import sqlite3
+
+        self.table = table
+        self.connection = sqlite3.connect(path)
+
+    @staticmethod
+    def column_type(column_type: str) -> str:
+        column_type = strip_nullable(column_type)
+        if column_type.startswith("Array"):
+            return "TEXT"
+        for prefix, sqlite_type in SQLITE_TYPES.items():
+            if column_type.startswith(prefix):
+                return sqlite_type
+        raise ValueError(f"Unsupported type: {column_type}")
+
+    def open(self, columns: list[str], column_types: list[str]):
+        super().open(columns, column_types)
+        definitions = ", ".join(
+            f'"{column}" {self.column_type(column_type)}'
+            for column, column_type in zip(columns, column_types)
+        )
+        self.connection.execute(
+            f'CREATE TABLE IF NOT EXISTS "{self.table}" ({definitions})'
+        )
+        self.array_columns = [
+            idx
+            for idx, column_type in enumerate(column_types)
+            if strip_nullable(column_type).startswith("Array")
+        ]
+        self.text_columns = [
+            idx
+            for idx, column_type in enumerate(column_types)
+            if self.column_type(column_type) == "TEXT" and idx not in self.array_columns
+        ]
+        placeholders = ", ".join("?" * len(columns))
+        quoted_columns = ", ".join(f'"{column}"' for column in columns)
+        self.insert_query = (
+            f'INSERT INTO "{self.table}" ({quoted_columns}) VALUES ({placeholders})'
+        )
+
+    def _prepare_row(self, row: list) -> list:
+        row = list(row)
+        for idx in self.text_columns:
+            value = row[idx]
+            if isinstance(value, (date, datetime)):
+                row[idx] = _json_default(value)
+            elif value is not None and not isinstance(value, str):
+                row[idx] = str(value)
+        for idx in self.array_columns:
+            row[idx] = json.dumps(row[idx], default=_json_default, ensure_ascii=False)
+        return row
+
+    def write_batch(self, batch: list[list]):
+        with self.connection:
+            self.connection.executemany(
+                self.insert_query, [self._prepare_row(row) for row in batch]
+            )
+
+    def close(self):
+        self.connection.close()
+
+
+DUCKDB_TYPES = {
+    "UInt8": "UTINYINT",
+    "UInt16": "USMALLINT",
+    "UInt32": "UINTEGER",
+    "UInt64": "UBIGINT",
+    "Int8": "TINYINT",
+    "Int16": "SMALLINT",
+    "Int32": "INTEGER",
+    "Int64": "BIGINT",
+    "Float32": "FLOAT",
+    "Float64": "DOUBLE",
+    "Date": "DATE",
+    "DateTime": "TIMESTAMP",
+    "String": "VARCHAR",
+}
+
+
+class DuckDBSink(Sink):
+    """Table in a local DuckDB database, created on the first write if missing.
+
+    Requires the `duckdb` package. Batches are passed to DuckDB as columnar
+    data frames rather than row by row.
+    """
+
+    def __init__(self, path: str, table: str):
+        try:
+            import duckdb
+        except ImportError:
+            raise RuntimeError("The `duckdb` package is required: pip install duckdb")
+
+        self.table = table
+        self.connection = duckdb.connect(path)
+
+    @staticmethod
+    def column_type(column_type: str) -> str:
+        # Dictionary encoding is a storage detail of Clickhouse
+        column_type = strip_nullable(strip_low_cardinality(column_type))
+        if column_type.startswith("Array"):
+            return DuckDBSink.column_type(column_type[6:-1]) + "[]"
+        if column_type not in DUCKDB_TYPES:
+            raise ValueError(f"Unsupported type: {column_type}")
+        return DUCKDB_TYPES[column_type]
+
+    def open(self, columns: list[str], column_types: list[str]):
+        super().open(columns, column_types)
+        definitions = ", ".join(
+            f'"{column}" {self.column_type(column_type)}'
+            for column, column_type in zip(columns, column_types)
+        )
+        self.connection.execute(
+            f'CREATE TABLE IF NOT EXISTS "{self.table}" ({definitions})'
+        )
+        quoted_columns = ", ".join(f'"{column}"' for column in columns)
+        self.insert_query = (
+            f'INSERT INTO "{self.table}" ({quoted_columns}) SELECT * FROM batch_df'
+        )
+
+    def write_batch(self, batch: list[list]):
+        import pandas as pd
+
+        batch_df = pd.DataFrame(batch, columns=self.columns, dtype=object)
+        self.connection.register("batch_df", batch_df)
+        try:
+            self.connection.execute(self.insert_query)
+        finally:
+            self.connection.unregister("batch_df")
+
+    def close(self):
+        self.connection.close()
+
+
+def write_batches(sink: Sink, batches: Iterable[list[list]]) -> int:
+    """Write row batches into an opened sink, returns the number of rows."""
+    rows_num = 0
+    for batch in batches:
+        sink.write_batch(batch)
+        rows_num += len(batch)
+    return rows_num
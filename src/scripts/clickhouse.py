@@ -1,40 +1,107 @@
 import os
 import sys
+import glob
 import argparse
-import math
 import csv
+import time
+from itertools import islice
+from operator import itemgetter
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from string import Template
-from datetime import datetime
-
-from dotenv import load_dotenv
-from tabulate import tabulate
-import clickhouse_connect
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 
-from db.clickhouse.types import columns_types
-from utils.utils import fprint
+from db.clickhouse.ddl import (
+    is_low_cardinality,
+    is_non_nullable,
+    optimized_column_type,
+    strip_nullable,
+)
+from db.clickhouse.convert import make_row_converter
+from db.clickhouse.batching import BATCH_MODES, make_batch_policy
+from db.clickhouse.checkpoint import (
+    Checkpoint,
+    ImportLedger,
+    checkpoint_filename,
+    deduplication_token,
+    file_identity,
+    load_checkpoint,
+    save_checkpoint,
+)
+from db.clickhouse.cluster import (
+    check_sharding_hash,
+    create_cluster_tables,
+    get_shards,
+    is_sharding_key_type,
+    local_table_name,
+)
+from db.clickhouse.transport import COMPRESSIONS, TRANSPORTS, get_client
+from db.clickhouse.partitions import (
+    backfill_partitions,
+    create_staging_table,
+    drop_table,
+    get_partitions,
+    month_partition_id,
+    optimize_partitions,
+    replace_partitions,
+    staging_table_name,
+)
+from pipeline.sinks import ClickhouseSink, ShardedClickhouseSink
+from utils.utils import fprint, open_input_file
+from utils.fields import get_field_registry
+from utils.metrics import METRICS, add_metrics_arguments, start_metrics
+from utils.profiler import add_profile_arguments, start_profiling
 
 from config import (
     CLICKHOUSE_BATCH_SIZE,
+    CLICKHOUSE_BATCH_MODE,
+    CLICKHOUSE_BATCH_BYTES,
+    CLICKHOUSE_ADAPTIVE_TARGET_SECONDS,
+    CLICKHOUSE_ADAPTIVE_MIN_ROWS,
+    CLICKHOUSE_ADAPTIVE_MAX_ROWS,
+    CLICKHOUSE_TRANSPORT,
+    CLICKHOUSE_COMPRESSION,
+    CLICKHOUSE_POOL_SIZE,
+    CLICKHOUSE_CONNECT_TIMEOUT,
+    CLICKHOUSE_SEND_RECEIVE_TIMEOUT,
+    CLICKHOUSE_SESSION_SETTINGS,
     CLICKHOUSE_VISITS_FIELDS,
     CLICKHOUSE_CREATE_VISITS_TABLE,
     CLICKHOUSE_EVENTS_FIELDS,
     CLICKHOUSE_CREATE_EVENTS_TABLE,
-    FIELDS_RENAMING_MAPPING,
+    CLICKHOUSE_VISITS_ORDER_BY,
+    CLICKHOUSE_EVENTS_ORDER_BY,
+    CLICKHOUSE_CLUSTER,
+    CLICKHOUSE_CREATE_CLUSTER_VISITS_TABLE,
+    CLICKHOUSE_CREATE_CLUSTER_EVENTS_TABLE,
+    CLICKHOUSE_VISITS_SHARDING_KEY,
+    CLICKHOUSE_EVENTS_SHARDING_KEY,
     DEFAULT_ATTRIBUTION_MODEL,
 )
 
 
-def connect_to_clickhouse(host: str, port: int, user: str, password: str):
-    print(f"Connecting to Clickhouse: {user}@{host}:{port}…")
+def connect_to_clickhouse(
+    host: str,
+    port: int,
+    user: str,
+    password: str,
+    transport: str = CLICKHOUSE_TRANSPORT,
+    compression: str = CLICKHOUSE_COMPRESSION,
+):
+    print(f"Connecting to Clickhouse: {user}@{host}:{port} ({transport})…")
 
     try:
-        client = clickhouse_connect.get_client(
+        client = get_client(
             host=host,
             port=port,
-            username=user,
+            user=user,
             password=password,
+            transport=transport,
+            compression=compression,
+            pool_size=CLICKHOUSE_POOL_SIZE,
+            connect_timeout=CLICKHOUSE_CONNECT_TIMEOUT,
+            send_receive_timeout=CLICKHOUSE_SEND_RECEIVE_TIMEOUT,
+            settings=CLICKHOUSE_SESSION_SETTINGS,
         )
         return client
     except Exception as e:
@@ -47,75 +114,19 @@ def get_number_of_rows(client, table: str) -> int:
     return result[0][0]
 
 
-def convert_value(value, column_type):
-    """Convert value to appropriate type based on ClickHouse schema."""
-    if column_type.startswith("Nullable"):
-        column_type = column_type[9:-1]
-    if isinstance(value, str):
-        value = value.lstrip(r"\'")
-        value = value.rstrip(r"\'")
-    if column_type.startswith("UInt") or column_type.startswith("Int"):
-        return int(value) if value else None
-    elif column_type == "Float32" or column_type == "Float64":
-        return float(value) if value else None
-    elif column_type == "Date":
-        return datetime.strptime(value, "%Y-%m-%d").date() if value else None
-    elif column_type == "DateTime":
-        return datetime.strptime(value, "%Y-%m-%d %H:%M:%S") if value else None
-    elif column_type.startswith("Array"):
-        inner_type = column_type[6:-1]
-        if inner_type.startswith("Nullable"):
-            inner_type = inner_type[9:-1]
-        value = value.lstrip("[")
-        value = value.rstrip("]")
-        return [convert_value(x, inner_type) for x in value.split(",")] if value else []
-    elif column_type == "String":
-        return str(value)
-    else:
-        raise ValueError(f"Unsupported type: {column_type}")
-
-
-arg_parser = argparse.ArgumentParser(
-    # TODO
-    description=""
-)
-arg_parser.add_argument(
-    "table_name",
-    type=str,
-)
-arg_parser.add_argument(
-    "-s",
-    "--data-source",
-    choices=["visits", "hits"],
-    required=True,
-    help="which data to work with: visits or events (hits)",
-)
+def get_table_columns(client, table: str) -> list[str]:
+    return [row[0] for row in client.query(f"DESCRIBE TABLE {table}").result_rows]
 
-arg_group = arg_parser.add_mutually_exclusive_group(required=True)
-arg_group.add_argument(
-    "-i",
-    "--import-file",
-    metavar="TSV_FILENAME",
-    type=str,
-    help="import a file into the database",
-)
-arg_group.add_argument(
-    "-c",
-    "--create-table",
-    action="store_true",
-    help="create a new table",
-)
 
-arg_parser.add_argument(
-    "-R",
-    "--renamed-fields",
-    action="store_true",
-    help="use renamed fields",
-)
+def column_picker(indices: list[int]):
+    """Function that takes the values of the given columns from a raw row."""
+    if len(indices) == 1:
+        index = indices[0]
+        return lambda row: (row[index],)
+    return itemgetter(*indices)
 
-args = arg_parser.parse_args()
 
-load_dotenv()
+DESCRIPTION = "Creates Clickhouse tables and imports Logs API TSV files into them"
 
 ENV_VARS = [
     "CLICKHOUSE_HOST",
@@ -123,165 +134,793 @@ ENV_VARS = [
     "CLICKHOUSE_USER",
     "CLICKHOUSE_PASSWORD",
 ]
-conn_params = dict()
-for env_var in ENV_VARS:
-    value = os.getenv(env_var)
-    if not value and env_var != "CLICKHOUSE_PASSWORD":
-        print(f"Environment variable `{env_var}` is missing", file=sys.stderr)
-        exit(1)
-    conn_params[env_var] = value
 
 
-if args.create_table:
+def add_arguments(arg_parser: argparse.ArgumentParser):
+    arg_parser.add_argument(
+        "table_name",
+        type=str,
+    )
+    arg_parser.add_argument(
+        "-s",
+        "--data-source",
+        choices=["visits", "hits"],
+        required=True,
+        help="which data to work with: visits or events (hits)",
+    )
+
+    arg_group = arg_parser.add_mutually_exclusive_group(required=True)
+    arg_group.add_argument(
+        "-i",
+        "--import-file",
+        metavar="TSV_FILENAME",
+        type=str,
+        help="import a file into the database, or all files matching a quoted glob pattern",
+    )
+    arg_group.add_argument(
+        "-c",
+        "--create-table",
+        action="store_true",
+        help="create a new table",
+    )
+
+    arg_parser.add_argument(
+        "-R",
+        "--renamed-fields",
+        action="store_true",
+        help="use renamed fields",
+    )
+    column_group = arg_parser.add_mutually_exclusive_group()
+    column_group.add_argument(
+        "--columns",
+        metavar="COL,…",
+        type=lambda value: [column.strip() for column in value.split(",") if column.strip()],
+        help="import only these columns of the file, the other ones are skipped",
+    )
+    column_group.add_argument(
+        "--table-columns",
+        action="store_true",
+        help="import only the columns of the file that the table has",
+    )
+    arg_parser.add_argument(
+        "--storage-optimized",
+        action="store_true",
+        help="create a table with LowCardinality types, codecs and without extra Nullable",
+    )
+    arg_parser.add_argument(
+        "--order-by",
+        metavar="EXPR",
+        type=str,
+        help="sorting key of a new table, e.g. '(date, clientID, visitID)'",
+    )
+    arg_parser.add_argument(
+        "--cluster",
+        metavar="NAME",
+        type=str,
+        default=CLICKHOUSE_CLUSTER,
+        help="create replicated tables on the cluster and a Distributed table over them, "
+        "import directly into the shards",
+    )
+    arg_parser.add_argument(
+        "--sharding-key",
+        metavar="COLUMN",
+        type=str,
+        help="column whose hash distributes rows between the shards",
+    )
+    arg_parser.add_argument(
+        "-b",
+        "--batch-mode",
+        choices=BATCH_MODES,
+        default=CLICKHOUSE_BATCH_MODE,
+        help="how to split the input into batches (default: %(default)s)",
+    )
+    arg_parser.add_argument(
+        "--transport",
+        choices=TRANSPORTS,
+        default=CLICKHOUSE_TRANSPORT,
+        help="protocol to connect to Clickhouse with (default: %(default)s)",
+    )
+    arg_parser.add_argument(
+        "--compression",
+        choices=COMPRESSIONS,
+        default=CLICKHOUSE_COMPRESSION,
+        help="compression of the data sent to Clickhouse (default: %(default)s)",
+    )
+    arg_parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="skip the batches committed by a previous run of the import",
+    )
+    arg_parser.add_argument(
+        "--checkpoint-file",
+        type=str,
+        help="where to record the import progress (default: next to the input file)",
+    )
+    arg_parser.add_argument(
+        "--watch",
+        action="store_true",
+        help="keep importing the files matching -i as they appear",
+    )
+    arg_parser.add_argument(
+        "-j",
+        "--jobs",
+        metavar="N",
+        type=int,
+        default=1,
+        help="how many files to import at once (default: %(default)s)",
+    )
+    arg_parser.add_argument(
+        "--ledger",
+        metavar="PATH",
+        type=str,
+        help="where to record the imported files of a pattern "
+        "(default: .TABLE_NAME.imported in the directory of the pattern)",
+    )
+    arg_parser.add_argument(
+        "--watch-interval",
+        metavar="SECONDS",
+        type=float,
+        default=5,
+        help="how often to look for new files (default: %(default)s)",
+    )
+    arg_parser.add_argument(
+        "--settle-time",
+        metavar="SECONDS",
+        type=float,
+        default=10,
+        help="import a watched file once it hasn't changed for this long (default: %(default)s)",
+    )
+    arg_parser.add_argument(
+        "--reload",
+        action="store_true",
+        help="load the file into a staging table and replace the affected partitions with it",
+    )
+    arg_parser.add_argument(
+        "--clean-report",
+        metavar="ID",
+        type=int,
+        help="delete the Logs API report the file was downloaded from once it is imported",
+    )
+    arg_parser.add_argument(
+        "--counter-id",
+        type=int,
+        help="YM counter ID of the report for --clean-report",
+    )
+    arg_parser.add_argument(
+        "--optimize",
+        action="store_true",
+        help="run OPTIMIZE ... FINAL on the partitions written by the import",
+    )
+    arg_parser.add_argument(
+        "--optimize-jobs",
+        metavar="N",
+        type=int,
+        default=2,
+        help="how many partitions to optimize at once (default: %(default)s)",
+    )
+    arg_parser.add_argument(
+        "--optimize-time-budget",
+        metavar="SECONDS",
+        type=float,
+        help="do not start optimizing new partitions after this time",
+    )
+    add_metrics_arguments(arg_parser)
+    add_profile_arguments(arg_parser)
+
+
+def get_conn_params() -> dict:
+    from dotenv import load_dotenv
+
+    load_dotenv()
+
+    conn_params = dict()
+    for env_var in ENV_VARS:
+        value = os.getenv(env_var)
+        if not value and env_var != "CLICKHOUSE_PASSWORD":
+            print(f"Environment variable `{env_var}` is missing", file=sys.stderr)
+            exit(1)
+        conn_params[env_var] = value
+    return conn_params
+
+
+def create_table(args, conn_params: dict):
+    from tabulate import tabulate
+
     if args.data_source == "visits":
         ym_fields = CLICKHOUSE_VISITS_FIELDS
-        query_tmpl = Template(CLICKHOUSE_CREATE_VISITS_TABLE)
+        if args.cluster:
+            query_tmpl = Template(CLICKHOUSE_CREATE_CLUSTER_VISITS_TABLE)
+        else:
+            query_tmpl = Template(CLICKHOUSE_CREATE_VISITS_TABLE)
+        order_by = args.order_by or CLICKHOUSE_VISITS_ORDER_BY
+        sharding_key = args.sharding_key or CLICKHOUSE_VISITS_SHARDING_KEY
     else:
         ym_fields = CLICKHOUSE_EVENTS_FIELDS
-        query_tmpl = Template(CLICKHOUSE_CREATE_EVENTS_TABLE)
+        if args.cluster:
+            query_tmpl = Template(CLICKHOUSE_CREATE_CLUSTER_EVENTS_TABLE)
+        else:
+            query_tmpl = Template(CLICKHOUSE_CREATE_EVENTS_TABLE)
+        order_by = args.order_by or CLICKHOUSE_EVENTS_ORDER_BY
+        sharding_key = args.sharding_key or CLICKHOUSE_EVENTS_SHARDING_KEY
 
     table_name = args.table_name
     table_fields_str = ""
     output_table = []
+    sharding_key_type = None
 
-    ym_fields = [f.replace("<attr>", DEFAULT_ATTRIBUTION_MODEL) for f in ym_fields]
+    fields = get_field_registry()
+    ym_fields = [fields.expand(f, DEFAULT_ATTRIBUTION_MODEL) for f in ym_fields]
 
-    for field in ym_fields:
-        if field in FIELDS_RENAMING_MAPPING:
+    for ym_field in ym_fields:
+        field = fields.by_name.get(ym_field)
+        if field and field.renamed and field.type:
             if args.renamed_fields:
-                table_fields_str += f"{FIELDS_RENAMING_MAPPING[field]} "
+                table_fields_str += f"{field.renamed} "
             else:
-                table_fields_str += f"{field} "
-            table_fields_str += f"{columns_types[field]},"
-            output_table.append(
-                {"Field": FIELDS_RENAMING_MAPPING[field], "Type": columns_types[field]}
-            )
+                table_fields_str += f"{field.name} "
+            column_type = field.type
+            if args.storage_optimized:
+                column_type = optimized_column_type(field.name, column_type)
+            table_fields_str += f"{column_type},"
+            if sharding_key == (field.renamed if args.renamed_fields else field.name):
+                sharding_key_type = column_type
+            output_table.append({"Field": field.renamed, "Type": column_type})
         else:
             print(
-                f"Field `{field}` of Clickhouse fields mapping is not available for renaming"
+                f"Field `{ym_field}` of Clickhouse fields mapping is not available for renaming"
             )
             exit(1)
 
+    if args.cluster and not (sharding_key_type and is_sharding_key_type(sharding_key_type)):
+        print(
+            f"The sharding key `{sharding_key}` must be a non-nullable UInt column of the table",
+            file=sys.stderr,
+        )
+        exit(1)
+
     table_fields_str = table_fields_str.rstrip(",")
-    query = query_tmpl.substitute(table_name=table_name, table_fields=table_fields_str)
+    query = query_tmpl.substitute(
+        table_name=local_table_name(table_name) if args.cluster else table_name,
+        table_fields=table_fields_str,
+        order_by=order_by,
+        cluster=args.cluster,
+    )
     ch = connect_to_clickhouse(
         host=conn_params["CLICKHOUSE_HOST"],
         port=int(conn_params["CLICKHOUSE_PORT"]),
         user=conn_params["CLICKHOUSE_USER"],
         password=conn_params["CLICKHOUSE_PASSWORD"],
+        transport=args.transport,
+        compression=args.compression,
     )
     if not ch:
         exit(1)
     print(f"Creating a table `{table_name}`…")
     try:
-        ch.command(query)
+        if args.cluster:
+            create_cluster_tables(ch, query, table_name, args.cluster, sharding_key)
+        else:
+            ch.command(query)
     except Exception as e:
         print(f"Can't create a table:\n\n{e}\n")
         exit(1)
 
-    print(f"Table `{table_name}` has been created:\n")
+    if args.cluster:
+        print(
+            f"Tables `{local_table_name(table_name)}` on cluster `{args.cluster}` "
+            f"and Distributed `{table_name}` have been created:\n"
+        )
+    else:
+        print(f"Table `{table_name}` has been created:\n")
     print(tabulate(output_table, headers="keys", tablefmt="pipe"))
 
-if args.import_file:
-    input_fname = args.import_file
+
+def import_file(args, conn_params: dict, input_fname: str, show_progress: bool = True):
+    from humanize import naturaldelta, naturalsize
+    from pipeline.pipeline import RowBatch, iter_policy_batches
+
+    if args.reload and (args.columns or args.table_columns):
+        # The replaced partitions would keep only defaults in the skipped columns
+        print("--reload replaces whole partitions, it imports all columns", file=sys.stderr)
+        exit(1)
 
     if args.data_source == "visits":
         ym_fields = CLICKHOUSE_VISITS_FIELDS
+        sharding_key = args.sharding_key or CLICKHOUSE_VISITS_SHARDING_KEY
     else:
         ym_fields = CLICKHOUSE_EVENTS_FIELDS
-    ym_fields = [f.replace("<attr>", DEFAULT_ATTRIBUTION_MODEL) for f in ym_fields]
+        sharding_key = args.sharding_key or CLICKHOUSE_EVENTS_SHARDING_KEY
+    fields = get_field_registry()
+    ym_fields = [fields.expand(f, DEFAULT_ATTRIBUTION_MODEL) for f in ym_fields]
 
     if args.renamed_fields:
-        ch_fields = []
-        for field in ym_fields:
-            if field in FIELDS_RENAMING_MAPPING:
-                ch_fields.append(FIELDS_RENAMING_MAPPING[field])
-            else:
-                print(
-                    f"Field `{field}` of Clickhouse fields mapping is not available for renaming"
-                )
-                exit(1)
+        ch_fields, missing_fields = fields.renamed_names(ym_fields)
+        if missing_fields:
+            print(
+                f"Field `{missing_fields[0]}` of Clickhouse fields mapping is not available for renaming"
+            )
+            exit(1)
     else:
         ch_fields = ym_fields
 
-    with open(input_fname, "r") as f:
+    with open_input_file(input_fname) as (f, _):
         reader = csv.reader(f, delimiter="\t")
         file_columns = next(reader)
 
-    columns_difference = set(file_columns).difference(set(ch_fields))
+    def connect(host: str | None = None):
+        return connect_to_clickhouse(
+            host=host or conn_params["CLICKHOUSE_HOST"],
+            port=int(conn_params["CLICKHOUSE_PORT"]),
+            user=conn_params["CLICKHOUSE_USER"],
+            password=conn_params["CLICKHOUSE_PASSWORD"],
+            transport=args.transport,
+            compression=args.compression,
+        )
+
+    ch = None
+    # The columns to import, the other columns of the file are skipped
+    # before conversion
+    if args.table_columns:
+        ch = connect()
+        if not ch:
+            exit(1)
+        try:
+            table_columns = set(get_table_columns(ch, args.table_name))
+        except Exception as e:
+            print(f"Can't get the columns of `{args.table_name}`:\n\n{e}\n")
+            exit(1)
+        columns = [c for c in file_columns if c in table_columns and c in ch_fields]
+        if not columns:
+            print("The input file has no columns of the table", file=sys.stderr)
+            exit(1)
+    elif args.columns:
+        columns = list(dict.fromkeys(args.columns))
+        missing_columns = [c for c in columns if c not in file_columns]
+        if missing_columns:
+            print(f"The input file has no columns: {', '.join(missing_columns)}", file=sys.stderr)
+            exit(1)
+    else:
+        columns = file_columns
+
+    columns_difference = set(columns).difference(set(ch_fields))
     if len(columns_difference) > 0:
         print(
             "The field names in the input file do not match the database:\n\n",
             ", ".join(columns_difference),
         )
         exit(1)
-
-    file_columns_types = []
-    for file_col in file_columns:
+    if columns != file_columns:
+        pick_columns = column_picker([file_columns.index(c) for c in columns])
+        skipped = len(file_columns) - len(columns)
+        print(f"Importing {len(columns)} columns of the file, skipping {skipped}")
+    else:
+        pick_columns = None
+
+    columns_types = []
+    low_cardinality_columns = []
+    non_nullable_columns = []
+    date_column = None
+    date_column_idx = None
+    for column in columns:
         if args.renamed_fields:
-            ym_col = ""
-            for k, v in FIELDS_RENAMING_MAPPING.items():
-                if v == file_col:
-                    ym_col = k
-            file_columns_types.append(columns_types[ym_col])
+            ym_col = fields.by_renamed[(args.data_source, column)].name
         else:
-            file_columns_types.append(columns_types[file_col])
+            ym_col = column
+        columns_types.append(fields.by_name[ym_col].type)
+        if is_low_cardinality(ym_col) and strip_nullable(columns_types[-1]) == "String":
+            low_cardinality_columns.append(len(columns_types) - 1)
+        if is_non_nullable(ym_col):
+            # Not Nullable in the tables created with --storage-optimized
+            non_nullable_columns.append(len(columns_types) - 1)
+        if ym_col in ("ym:s:date", "ym:pv:date"):
+            date_column = column
+            date_column_idx = len(columns_types) - 1
+
+    if args.clean_report and not args.counter_id:
+        print("--clean-report requires --counter-id", file=sys.stderr)
+        exit(1)
+    if args.clean_report and not os.getenv("YM_AUTH_TOKEN"):
+        print("Environment variable `YM_AUTH_TOKEN` is missing", file=sys.stderr)
+        exit(1)
 
-    print("Reading the input file…")
-    with open(input_fname, "r") as f:
-        total_rows = sum(1 for _ in f)
-    total_rows -= 1
+    if args.cluster and args.reload:
+        print("--reload is not supported in the cluster mode", file=sys.stderr)
+        exit(1)
+    if args.cluster and sharding_key not in columns:
+        print(f"The imported columns have no sharding key `{sharding_key}`", file=sys.stderr)
+        exit(1)
+    if args.cluster:
+        key_idx = columns.index(sharding_key)
+        key_type = columns_types[key_idx]
+        if key_idx in non_nullable_columns:
+            key_type = strip_nullable(key_type)
+        if not is_sharding_key_type(key_type):
+            print(
+                f"The sharding key column `{sharding_key}` must be a non-nullable UInt",
+                file=sys.stderr,
+            )
+            exit(1)
 
-    ch = connect_to_clickhouse(
-        host=conn_params["CLICKHOUSE_HOST"],
-        port=int(conn_params["CLICKHOUSE_PORT"]),
-        user=conn_params["CLICKHOUSE_USER"],
-        password=conn_params["CLICKHOUSE_PASSWORD"],
-    )
-    if not ch:
+    if (args.reload or args.optimize) and not date_column:
+        print("The imported columns have no `date` to find partitions by", file=sys.stderr)
         exit(1)
 
+    if ch is None:
+        ch = connect()
+        if not ch:
+            exit(1)
+
     table_name = args.table_name
+    insert_table = local_table_name(table_name) if args.cluster else table_name
+
+    file_id = file_identity(input_fname)
+    if args.reload:
+        insert_table = staging_table_name(table_name, file_id)
+        print(f"Creating a staging table `{insert_table}`…")
+        try:
+            if not args.resume:
+                drop_table(ch, insert_table)
+            create_staging_table(ch, table_name, insert_table)
+        except Exception as e:
+            print(f"Can't create a staging table:\n\n{e}\n")
+            exit(1)
+
+    checkpoint_fname = args.checkpoint_file or checkpoint_filename(input_fname, table_name)
+    checkpoint = Checkpoint(file_id=file_id, table=insert_table)
+    if args.resume:
+        prev_checkpoint = load_checkpoint(checkpoint_fname)
+        if prev_checkpoint is None:
+            print("No checkpoint found, importing from the beginning")
+        elif prev_checkpoint.file_id != file_id or prev_checkpoint.table != insert_table:
+            print(
+                f"Checkpoint `{checkpoint_fname}` belongs to another file or table",
+                file=sys.stderr,
+            )
+            exit(1)
+        elif prev_checkpoint.completed and not args.reload:
+            print("The file has already been imported completely")
+            # A previous run may have failed to clean the report
+            if args.clean_report:
+                clean_imported_report(args)
+            return
+        elif prev_checkpoint.completed:
+            checkpoint = prev_checkpoint
+            print("The file has already been loaded into the staging table")
+        else:
+            checkpoint = prev_checkpoint
+            print(
+                f"Resuming after batch {checkpoint.batch_num}, "
+                f"{checkpoint.rows_committed} rows already committed"
+            )
 
-    batches_num = math.ceil(total_rows / CLICKHOUSE_BATCH_SIZE)
+    # The progress is recorded also without --resume, so that a failed import
+    # can be resumed. If it can't be, e.g. in a read-only directory, the import
+    # goes on without it, unless resuming was asked for
+    checkpointing = True
+
+    def record_checkpoint():
+        nonlocal checkpointing
+        if not checkpointing:
+            return
+        try:
+            save_checkpoint(checkpoint_fname, checkpoint)
+        except OSError as e:
+            if args.resume:
+                print(
+                    "\nCan't save the checkpoint, set another path with --checkpoint-file:"
+                    f"\n\n{e}\n",
+                    file=sys.stderr,
+                )
+                exit(1)
+            print(f"\nCan't save the checkpoint, the import can't be resumed: {e}", file=sys.stderr)
+            checkpointing = False
+
+    if args.resume:
+        # Fail before inserting anything if the checkpoint can't be saved
+        record_checkpoint()
+
+    try:
+        batch_policy = make_batch_policy(
+            mode=args.batch_mode,
+            batch_size=CLICKHOUSE_BATCH_SIZE,
+            batch_bytes=CLICKHOUSE_BATCH_BYTES,
+            adaptive_target_seconds=CLICKHOUSE_ADAPTIVE_TARGET_SECONDS,
+            adaptive_min_rows=CLICKHOUSE_ADAPTIVE_MIN_ROWS,
+            adaptive_max_rows=CLICKHOUSE_ADAPTIVE_MAX_ROWS,
+        )
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        exit(1)
+    print(f"Batch size: {batch_policy.describe()}")
+
+    file_size = os.path.getsize(input_fname)
     rows_num_before = get_number_of_rows(ch, table_name)
 
-    with open(input_fname, "r") as f:
-        reader = csv.reader(f, delimiter="\t")
-        next(reader)
-
-        batch = []
-        batch_num = 1
-        row_num = 1
-        for row in reader:
-            typed_row = []
-            for idx in range(0, len(row)):
-                typed_val = convert_value(row[idx], file_columns_types[idx])
-                typed_row.append(typed_val)
-            batch.append(typed_row)
-
-            if len(batch) == CLICKHOUSE_BATCH_SIZE:
-                progress_pct = round((row_num / total_rows) * 100, 2)
-                fprint(
-                    f"Uploading data: {row_num}/{total_rows} rows, {batch_num}/{batches_num} batches, {progress_pct}%"
+    def print_progress(row_num: int, batch_num: int):
+        bytes_read = raw_file.tell()
+        progress_pct = round((bytes_read / file_size) * 100, 2) if file_size else 100.0
+        line = (
+            f"Uploading data: {row_num} rows, {batch_num} batches, "
+            f"{naturalsize(bytes_read, binary=True)}/{naturalsize(file_size, binary=True)}, "
+            f"{progress_pct}%"
+        )
+        elapsed = time.monotonic() - import_started_at
+        if bytes_read > bytes_at_start and elapsed > 0:
+            speed = (bytes_read - bytes_at_start) / elapsed
+            line += f", ETA {naturaldelta((file_size - bytes_read) / speed)}"
+        fprint(line)
+
+    def upload_batch(batch: RowBatch, batch_num: int):
+        row_num = batch.last_row
+        rows_num = len(batch.rows)
+        if show_progress:
+            print_progress(row_num, batch_num)
+        token = deduplication_token(file_id, insert_table, batch_num, row_num - rows_num + 1, row_num)
+        checkpoint.rows_pending = row_num
+        record_checkpoint()
+        started_at = time.monotonic()
+        # Reading, parsing and converting the rows of the batch
+        METRICS.record_stage("convert", started_at - batch.started_at, rows_num, batch.size)
+        try:
+            sink.write_batch(batch.rows, settings={"insert_deduplication_token": token})
+        except Exception as e:
+            print(f"\nError while uploading data:\n\n{e}\n")
+            if checkpointing:
+                print(
+                    f"Committed batches are recorded in `{checkpoint_fname}`, "
+                    "rerun with --resume to continue"
                 )
-                try:
-                    ch.insert(table_name, batch, column_names=file_columns)
-                except Exception as e:
-                    print(f"\nError while uploading data:\n\n{e}\n")
-                    exit(1)
-                batch.clear()
-                batch_num += 1
-            row_num += 1
-        if batch:
-            progress_pct = round((row_num / total_rows) * 100, 2)
-            fprint(
-                f"Uploading data: {row_num-1}/{total_rows} rows, {batch_num}/{batches_num} batches, {progress_pct}%"
+            exit(1)
+        elapsed = time.monotonic() - started_at
+        METRICS.record_stage("insert", elapsed, rows_num, batch.size)
+        batch_policy.record_insert(rows_num, batch.size, elapsed)
+        checkpoint.batch_num = batch_num
+        checkpoint.rows_committed = row_num
+        checkpoint.rows_pending = 0
+        checkpoint.partitions = sorted(touched_partitions)
+        record_checkpoint()
+
+    if args.cluster:
+        try:
+            check_sharding_hash(ch)
+            shards = get_shards(ch, args.cluster)
+            if not shards:
+                raise ValueError(f"Cluster `{args.cluster}` is not found")
+            print(f"Inserting into {len(shards)} shards of cluster `{args.cluster}`")
+            sink = ShardedClickhouseSink(connect, shards, insert_table, sharding_key)
+        except Exception as e:
+            print(f"Can't prepare a sharded import:\n\n{e}\n")
+            exit(1)
+    else:
+        sink = ClickhouseSink(ch, insert_table)
+    sink.open(columns, columns_types)
+    # `clickhouse-connect` takes DateTime values as Unix timestamps as they are,
+    # the native driver converts them by the server time zone instead
+    timestamps = "epoch" if args.transport == "http" else "datetime"
+    convert_row = make_row_converter(
+        columns_types, timestamps, low_cardinality_columns, non_nullable_columns
+    )
+    touched_partitions = set(checkpoint.partitions)
+
+    if not checkpoint.completed:
+        with open_input_file(input_fname) as (f, raw_file):
+            reader = csv.reader(f, delimiter="\t")
+            next(reader)
+
+            # Rows of the committed batches are skipped, the ETA is calculated only
+            # by the rows that are being imported
+            for _ in islice(reader, checkpoint.rows_committed):
+                pass
+            import_started_at = time.monotonic()
+            bytes_at_start = raw_file.tell() if checkpoint.rows_committed else 0
+            if pick_columns:
+                reader = map(pick_columns, reader)
+            # The batch that may have reached the server before is sent as it was
+            first_batch_end = 0
+            if checkpoint.rows_pending > checkpoint.rows_committed:
+                first_batch_end = checkpoint.rows_pending
+            batches = iter_policy_batches(
+                reader, convert_row, batch_policy, checkpoint.rows_committed, first_batch_end
+            )
+            for batch_num, batch in enumerate(batches, start=checkpoint.batch_num + 1):
+                if date_column_idx is not None:
+                    dates = {row[date_column_idx] for row in batch.rows}
+                    dates.discard(None)
+                    touched_partitions.update(map(month_partition_id, dates))
+                upload_batch(batch, batch_num)
+
+        checkpoint.completed = True
+        record_checkpoint()
+    sink.close()
+
+    if args.reload:
+        try:
+            partitions = get_partitions(ch, insert_table)
+            print(f"\nReplacing partitions: {', '.join(partitions)}")
+            backfill_partitions(ch, table_name, insert_table, partitions, date_column)
+            replace_partitions(ch, table_name, insert_table, partitions)
+            drop_table(ch, insert_table)
+        except Exception as e:
+            print(f"\nError while replacing partitions:\n\n{e}\n")
+            print(f"The staging table `{insert_table}` is kept, rerun with --resume to retry")
+            exit(1)
+        if os.path.exists(checkpoint_fname):
+            os.remove(checkpoint_fname)
+        touched_partitions = set(partitions)
+
+    if args.optimize and touched_partitions:
+        print(f"\nOptimizing partitions: {', '.join(sorted(touched_partitions))}")
+        try:
+            optimized, skipped = optimize_partitions(
+                connect,
+                local_table_name(table_name) if args.cluster else table_name,
+                sorted(touched_partitions),
+                jobs=args.optimize_jobs,
+                time_budget=args.optimize_time_budget,
+                cluster=args.cluster,
             )
-            ch.insert(table_name, batch, column_names=ch_fields)
+        except Exception as e:
+            print(f"\nError while optimizing partitions:\n\n{e}\n")
+            exit(1)
+        print(f"Partitions optimized: {len(optimized)}")
+        if skipped:
+            print(f"Out of the time budget, skipped partitions: {', '.join(skipped)}")
 
     rows_num_after = get_number_of_rows(ch, table_name)
     print(
         f"\nDone. Rows before: {rows_num_before}, after: {rows_num_after}, "
         f"diff: {rows_num_after - rows_num_before}"
     )
+
+    if args.clean_report:
+        clean_imported_report(args)
+
+
+def clean_imported_report(args):
+    from logs_api.logs_api import LogsAPI
+    from pipeline.pipeline import clean_report
+
+    ym = LogsAPI(auth_token=os.getenv("YM_AUTH_TOKEN"), counter_id=args.counter_id)
+    result = clean_report(ym, args.clean_report)
+    if result.success:
+        print(f"Report #{args.clean_report} has been deleted from the server")
+    else:
+        print(
+            f"Can't delete report #{args.clean_report}. Error:\n\n{result.error}\n",
+            file=sys.stderr,
+        )
+        exit(1)
+
+
+def is_input_file(fname: str) -> bool:
+    """Skip the files that are still being written and the ones of the import itself."""
+    name = os.path.basename(fname)
+    return (
+        os.path.isfile(fname)
+        and not name.startswith(".")
+        and not name.endswith((".part", ".tmp", ".checkpoint", ".imported"))
+    )
+
+
+def pattern_directory(pattern: str) -> str:
+    """The longest leading directory of a pattern without glob characters."""
+    parts = []
+    for part in os.path.dirname(pattern).split(os.sep):
+        if glob.has_magic(part):
+            break
+        parts.append(part)
+    return os.sep.join(parts) or ("/" if pattern.startswith("/") else ".")
+
+
+def import_files(args, conn_params: dict):
+    """Import a file, or the files matching a pattern, once or as they appear."""
+    pattern = args.import_file
+    if not args.watch and not glob.has_magic(pattern):
+        import_file(args, conn_params, pattern)
+        return
+
+    if args.checkpoint_file or args.clean_report:
+        print("--checkpoint-file and --clean-report need a single input file", file=sys.stderr)
+        exit(1)
+    if args.reload and args.jobs > 1:
+        print("--reload imports one file at a time, without -j", file=sys.stderr)
+        exit(1)
+
+    table_name = args.table_name
+    ledger_fname = args.ledger or os.path.join(
+        pattern_directory(pattern), f".{table_name}.imported"
+    )
+    ledger = ImportLedger(ledger_fname)
+    show_progress = args.jobs == 1
+    executor = ThreadPoolExecutor(args.jobs, thread_name_prefix="import")
+    # (name, size, modification time) -> identity, not to hash the same file on every scan
+    identities = {}
+    failed_ids = set()
+    running = {}
+    imported = 0
+
+    def run_import(input_fname: str) -> bool:
+        # The import of every file is resumable, so that an interrupted one
+        # continues after its committed batches on the next run. If no
+        # checkpoint can be written next to the file, it's imported without one
+        resume = os.access(os.path.dirname(input_fname) or ".", os.W_OK)
+        file_args = argparse.Namespace(**{**vars(args), "resume": resume})
+        try:
+            import_file(file_args, conn_params, input_fname, show_progress)
+        except SystemExit as e:
+            return not e.code
+        return True
+
+    def pending_files():
+        now = time.time()
+        for input_fname in sorted(glob.glob(pattern)):
+            if not is_input_file(input_fname):
+                continue
+            stat = os.stat(input_fname)
+            if args.watch and now - stat.st_mtime < args.settle_time:
+                continue
+            key = (input_fname, stat.st_size, stat.st_mtime)
+            if key not in identities:
+                identities[key] = file_identity(input_fname)
+            file_id = identities[key]
+            if (file_id, table_name) in ledger or file_id in failed_ids:
+                continue
+            yield input_fname, file_id
+
+    def collect(futures):
+        nonlocal imported
+        for future in futures:
+            input_fname, file_id = running.pop(future)
+            if future.exception() is None and future.result():
+                ledger.add(file_id, table_name, input_fname)
+                imported += 1
+                print(f"\nImported: {input_fname}")
+            else:
+                # Retried only if the file changes
+                failed_ids.add(file_id)
+                error = future.exception()
+                print(f"\nFailed: {input_fname}" + (f"\n\n{error}\n" if error else ""))
+
+    if args.watch:
+        print(f"Watching `{pattern}`, press Ctrl+C to stop…")
+    try:
+        while True:
+            for input_fname, file_id in pending_files():
+                if len(running) >= args.jobs:
+                    break
+                if any(file_id == running_id for _, running_id in running.values()):
+                    continue
+                print(f"\nImporting: {input_fname}")
+                running[executor.submit(run_import, input_fname)] = (input_fname, file_id)
+            if running:
+                done, _ = wait(running, timeout=args.watch_interval, return_when=FIRST_COMPLETED)
+                collect(done)
+            elif args.watch:
+                time.sleep(args.watch_interval)
+            else:
+                break
+    except KeyboardInterrupt:
+        print("\nStopping once the running imports are finished…")
+        executor.shutdown(wait=True)
+        collect(list(running))
+    executor.shutdown()
+
+    print(f"\nFiles imported: {imported}, failed: {len(failed_ids)}")
+    if failed_ids:
+        exit(1)
+
+
+def main(args):
+    start_metrics(args)
+    start_profiling(args)
+    conn_params = get_conn_params()
+    if args.create_table:
+        create_table(args, conn_params)
+    if args.import_file:
+        import_files(args, conn_params)
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description=DESCRIPTION)
+    add_arguments(arg_parser)
+    main(arg_parser.parse_args())
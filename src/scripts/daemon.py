@@ -0,0 +1,416 @@
+import os
+import sys
+import time
+import signal
+import argparse
+import threading
+import datetime as dt
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from pipeline.jobs import Job, JobStore
+from utils.metrics import METRICS, add_metrics_arguments, start_metrics
+from utils.profiler import add_profile_arguments, start_profiling
+
+from config import (
+    WAIT_INTERVAL,
+    LOGS_API_QUOTA,
+    QUOTA_WAIT_INTERVAL,
+    DEFAULT_ATTRIBUTION_MODEL,
+    CLICKHOUSE_VISITS_FIELDS,
+    CLICKHOUSE_EVENTS_FIELDS,
+    DAEMON_COUNTERS,
+    DAEMON_SYNC_DAYS,
+    DAEMON_DB,
+    DAEMON_DATA_DIR,
+    DAEMON_DELETE_FILES,
+    DAEMON_WORKERS,
+    DAEMON_INTERVAL,
+    DAEMON_MAX_ATTEMPTS,
+)
+
+DESCRIPTION = (
+    "Keeps Clickhouse tables in sync with Logs API: orders, downloads, imports "
+    "and cleans reports, and resumes its jobs after a restart"
+)
+
+# Stage -> the status of the jobs it takes, the statuses go in the same order
+STAGES = {
+    "order": "new",
+    "check": "ordered",
+    "download": "processed",
+    "import": "downloaded",
+    "clean": "imported",
+}
+
+# Statuses of reports that will never be processed, the job orders a new one
+LOST_REPORT_STATUSES = (
+    "canceled",
+    "processing_failed",
+    "cleaned_by_user",
+    "cleaned_automatically_as_too_old",
+)
+CLEANED_REPORT_STATUSES = ("cleaned_by_user", "cleaned_automatically_as_too_old")
+
+
+def log(job: Job | None, message: str):
+    line = f"{dt.datetime.now():%Y-%m-%d %H:%M:%S}"
+    if job:
+        line += f" job #{job.id} ({job.counter_id} {job.source} {job.date1}..{job.date2})"
+    print(f"{line}: {message}", flush=True)
+
+
+def add_arguments(arg_parser: argparse.ArgumentParser):
+    arg_parser.add_argument(
+        "--db",
+        metavar="PATH",
+        type=str,
+        default=DAEMON_DB,
+        help="SQLite database of the jobs (default: %(default)s)",
+    )
+    commands = arg_parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser(
+        "run", help="keep the counters of DAEMON_COUNTERS in sync and run the jobs"
+    )
+    add_metrics_arguments(run_parser)
+    add_profile_arguments(run_parser)
+
+    add_parser = commands.add_parser("add", help="add a job, e.g. to backfill a period")
+    add_parser.add_argument(
+        "-c", "--counter-id", type=int, required=True, help="YM counter ID"
+    )
+    add_parser.add_argument(
+        "-s",
+        "--data-source",
+        choices=["visits", "hits"],
+        required=True,
+        help="which data to sync: visits or events (hits)",
+    )
+    add_parser.add_argument(
+        "-f",
+        "--from-date",
+        type=dt.date.fromisoformat,
+        required=True,
+        help="start date in ISO format (YYYY-MM-DD)",
+    )
+    add_parser.add_argument(
+        "-t",
+        "--to-date",
+        type=dt.date.fromisoformat,
+        required=True,
+        help="end date in ISO format (YYYY-MM-DD)",
+    )
+    add_parser.add_argument(
+        "--table", type=str, required=True, help="Clickhouse table to import into"
+    )
+    add_parser.add_argument(
+        "-R", "--renamed-fields", action="store_true", help="use renamed fields"
+    )
+
+    list_parser = commands.add_parser("list", help="list the jobs")
+    list_parser.add_argument(
+        "--failed", action="store_true", help="only the jobs that are out of attempts"
+    )
+
+    retry_parser = commands.add_parser(
+        "retry", help="give jobs that are out of attempts a new series of attempts"
+    )
+    retry_parser.add_argument("job_ids", metavar="ID", type=int, nargs="+")
+
+
+class Daemon:
+    def __init__(self, store: JobStore, auth_token: str, conn_params: dict):
+        from utils.fields import get_field_registry
+
+        self.store = store
+        self.auth_token = auth_token
+        self.conn_params = conn_params
+        self.fields = get_field_registry()
+        self.stopped = threading.Event()
+        # Set when a stage is over, so that the next one starts without delay
+        self.wakeup = threading.Event()
+        self.lock = threading.Lock()
+        # Job ID -> the stage it is going through
+        self.running: dict[int, str] = {}
+        self.executors = {
+            stage: ThreadPoolExecutor(DAEMON_WORKERS[stage], thread_name_prefix=stage)
+            for stage in STAGES
+        }
+
+    def make_api(self, job: Job):
+        from logs_api.logs_api import LogsAPI
+
+        ym_fields = CLICKHOUSE_VISITS_FIELDS if job.source == "visits" else CLICKHOUSE_EVENTS_FIELDS
+        return LogsAPI(
+            fields=[self.fields.expand(f, DEFAULT_ATTRIBUTION_MODEL) for f in ym_fields],
+            auth_token=self.auth_token,
+            counter_id=job.counter_id,
+            start_date=job.date1,
+            end_date=job.date2,
+            source=job.source,
+        )
+
+    def stage_order(self, job: Job) -> bool:
+        from logs_api.quota import estimate_report_size, report_days, used_quota
+        from pipeline.pipeline import find_report, order_report
+
+        ym = self.make_api(job)
+        # A report ordered right before a restart is picked up again
+        request_id = find_report(ym)
+        if not request_id:
+            reports = ym.get_all_reports_info()["requests"]
+            used = used_quota(reports)
+            size = estimate_report_size(
+                reports, job.source, report_days({"date1": job.date1, "date2": job.date2})
+            )
+            if used and LOGS_API_QUOTA - used < size:
+                self.store.postpone(job, QUOTA_WAIT_INTERVAL)
+                return False
+            request_id = order_report(ym)
+        self.store.advance(job, "ordered", request_id=request_id)
+        log(job, f"report #{request_id} is ordered")
+        return True
+
+    def stage_check(self, job: Job) -> bool:
+        ym = self.make_api(job)
+        status = ym.get_report_info(job.request_id)["log_request"]["status"]
+        if status == "processed":
+            self.store.advance(job, "processed")
+            log(job, f"report #{job.request_id} is processed")
+            return True
+        if status in LOST_REPORT_STATUSES:
+            self.store.update(job.id, status="new", request_id=None)
+            raise RuntimeError(f"report #{job.request_id} is {status}, it will be ordered again")
+        self.store.postpone(job, WAIT_INTERVAL)
+        return False
+
+    def stage_download(self, job: Job) -> bool:
+        from pipeline.pipeline import iter_report_parts, write_tsv
+
+        fname = os.path.join(
+            DAEMON_DATA_DIR, f"{job.counter_id}_{job.source}_{job.date1}_{job.date2}.tsv"
+        )
+        # The file appears under its name only when it is complete
+        tmp_fname = f"{fname}.part"
+        ym = self.make_api(job)
+        for part in iter_report_parts(ym, job.request_id):
+            columns = part.columns
+            if job.renamed_fields:
+                columns, missing_fields = self.fields.renamed_names(columns)
+                if missing_fields:
+                    raise RuntimeError(f"field `{missing_fields[0]}` is not available for renaming")
+            with METRICS.stage("write") as stage:
+                write_tsv(tmp_fname, columns, part.rows, append=part.number > 1)
+                stage.rows += len(part.rows)
+        # The report may be cleaned as soon as the file is imported
+        with open(tmp_fname, "rb") as f:
+            os.fsync(f.fileno())
+        os.replace(tmp_fname, fname)
+        self.store.advance(job, "downloaded", file=fname)
+        log(job, f"report #{job.request_id} is saved in {fname}")
+        return True
+
+    def stage_import(self, job: Job) -> bool:
+        from scripts import clickhouse
+
+        arg_parser = argparse.ArgumentParser()
+        clickhouse.add_arguments(arg_parser)
+        argv = [job.table_name, "-s", job.source, "-i", job.file, "--resume"]
+        if job.renamed_fields:
+            argv.append("-R")
+        # The same import as `clickhouse.py`, which ends with `exit()` on errors.
+        # Committed batches are checkpointed, so a retry continues after them
+        try:
+            clickhouse.import_file(
+                arg_parser.parse_args(argv), self.conn_params, job.file, show_progress=False
+            )
+        except SystemExit as e:
+            if e.code:
+                raise RuntimeError(f"import of {job.file} into `{job.table_name}` has failed")
+        self.store.advance(job, "imported")
+        log(job, f"{job.file} is imported into `{job.table_name}`")
+        return True
+
+    def stage_clean(self, job: Job) -> bool:
+        from db.clickhouse.checkpoint import checkpoint_filename
+        from pipeline.pipeline import clean_report
+
+        ym = self.make_api(job)
+        # Could have been cleaned right before a restart
+        status = ym.get_report_info(job.request_id)["log_request"]["status"]
+        if status not in CLEANED_REPORT_STATUSES:
+            result = clean_report(ym, job.request_id)
+            if not result.success:
+                raise RuntimeError(f"can't delete report #{job.request_id}: {result.error}")
+        if DAEMON_DELETE_FILES:
+            for fname in (job.file, checkpoint_filename(job.file, job.table_name)):
+                if os.path.exists(fname):
+                    os.remove(fname)
+        self.store.advance(job, "cleaned")
+        log(job, f"report #{job.request_id} is deleted from the server")
+        return True
+
+    def run_stage(self, stage: str, job: Job):
+        try:
+            advanced = getattr(self, f"stage_{stage}")(job)
+        except Exception as e:
+            METRICS.add("daemon_stages", stage=stage, outcome="error")
+            self.store.fail(job, f"{stage}: {e}", DAEMON_MAX_ATTEMPTS, DAEMON_INTERVAL)
+            log(job, f"{stage} has failed, attempt {job.attempts + 1}/{DAEMON_MAX_ATTEMPTS}: {e}")
+        else:
+            METRICS.add("daemon_stages", stage=stage, outcome="ok" if advanced else "postponed")
+        finally:
+            with self.lock:
+                del self.running[job.id]
+            self.wakeup.set()
+
+    def add_sync_jobs(self):
+        """Jobs for the last days of the counters, the ones that exist are skipped."""
+        today = dt.date.today()
+        for counter in DAEMON_COUNTERS:
+            for days_ago in range(DAEMON_SYNC_DAYS, 0, -1):
+                day = (today - dt.timedelta(days=days_ago)).isoformat()
+                added = self.store.add(
+                    counter["counter_id"],
+                    counter["source"],
+                    day,
+                    day,
+                    counter["table"],
+                    counter.get("renamed_fields", False),
+                )
+                if added:
+                    log(None, f"added a job for {counter['counter_id']} {counter['source']} {day}")
+
+    def submit_due_jobs(self):
+        with self.lock:
+            for stage, status in STAGES.items():
+                busy = sum(1 for running_stage in self.running.values() if running_stage == stage)
+                for job in self.store.due(status, DAEMON_WORKERS[stage] - busy, set(self.running)):
+                    self.running[job.id] = stage
+                    self.executors[stage].submit(self.run_stage, stage, job)
+
+    def run(self):
+        next_sync_at = 0.0
+        while not self.stopped.is_set():
+            if time.monotonic() >= next_sync_at:
+                self.add_sync_jobs()
+                next_sync_at = time.monotonic() + DAEMON_INTERVAL
+            self.wakeup.clear()
+            self.submit_due_jobs()
+            self.wakeup.wait(min(WAIT_INTERVAL, DAEMON_INTERVAL))
+        for executor in self.executors.values():
+            executor.shutdown(wait=True)
+
+    def stop(self):
+        self.stopped.set()
+        self.wakeup.set()
+
+
+def run(args, store: JobStore):
+    from dotenv import load_dotenv
+    from scripts.clickhouse import get_conn_params
+
+    for counter in DAEMON_COUNTERS:
+        if not {"counter_id", "source", "table"} <= counter.keys():
+            print(f"`DAEMON_COUNTERS` entry needs counter_id, source and table: {counter}")
+            exit(1)
+        if counter["source"] not in ("visits", "hits"):
+            print(f"Source of `DAEMON_COUNTERS` must be visits or hits: {counter}")
+            exit(1)
+    if set(DAEMON_WORKERS) != set(STAGES) or min(DAEMON_WORKERS.values()) < 1:
+        print(f"`DAEMON_WORKERS` must set at least 1 worker for: {', '.join(STAGES)}")
+        exit(1)
+
+    start_metrics(args)
+    start_profiling(args)
+
+    load_dotenv()
+    auth_token = os.getenv("YM_AUTH_TOKEN")
+    if not auth_token:
+        print("Environment variable `YM_AUTH_TOKEN` is missing", file=sys.stderr)
+        exit(1)
+    conn_params = get_conn_params()
+    os.makedirs(DAEMON_DATA_DIR, exist_ok=True)
+
+    daemon = Daemon(store, auth_token, conn_params)
+
+    def handle_signal(signum, frame):
+        log(None, "stopping once the running stages are over, repeat to abort")
+        # The next signal kills the process, the jobs resume from their status
+        signal.signal(signum, signal.SIG_DFL)
+        daemon.stop()
+
+    signal.signal(signal.SIGINT, handle_signal)
+    signal.signal(signal.SIGTERM, handle_signal)
+
+    log(None, f"started, jobs are stored in {args.db}")
+    daemon.run()
+    log(None, "stopped")
+
+
+def list_jobs(args, store: JobStore):
+    from tabulate import tabulate
+
+    jobs = store.select("failed" if args.failed else "")
+    print(f"Jobs found: {len(jobs)}\n")
+    if not jobs:
+        exit(0)
+
+    table = []
+    for job in jobs:
+        error = job.error or ""
+        table.append(
+            {
+                "ID": job.id,
+                "Counter": job.counter_id,
+                "Source": job.source,
+                "Start date": job.date1,
+                "End date": job.date2,
+                "Table": job.table_name,
+                "Status": f"{job.status} (failed)" if job.failed else job.status,
+                "Report": job.request_id or "",
+                "Attempts": job.attempts,
+                "Last error": error if len(error) <= 60 else error[:59] + "…",
+            }
+        )
+    print(tabulate(table, headers="keys", tablefmt="pipe"))
+
+
+def main(args):
+    store = JobStore(args.db)
+
+    if args.command == "run":
+        run(args, store)
+
+    if args.command == "add":
+        if args.from_date > args.to_date:
+            print("The start date is after the end date", file=sys.stderr)
+            exit(1)
+        added = store.add(
+            args.counter_id,
+            args.data_source,
+            args.from_date.isoformat(),
+            args.to_date.isoformat(),
+            args.table,
+            args.renamed_fields,
+        )
+        print("The job has been added" if added else "The same job already exists")
+
+    if args.command == "list":
+        list_jobs(args, store)
+
+    if args.command == "retry":
+        for job_id in args.job_ids:
+            if store.get(job_id) is None:
+                print(f"Job #{job_id} is not found", file=sys.stderr)
+                exit(1)
+            store.retry(job_id)
+            print(f"Job #{job_id} will be retried")
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description=DESCRIPTION)
+    add_arguments(arg_parser)
+    main(arg_parser.parse_args())
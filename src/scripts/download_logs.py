@@ -1,26 +1,27 @@
-import time
 import os
 import re
 import sys
 import argparse
 import datetime as dt
 
-import pandas as pd
-from dotenv import load_dotenv
-from humanize import naturaldelta, naturalsize
-
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 
 from config import (
     WAIT_INTERVAL,
+    LOGS_API_QUOTA,
+    QUOTA_WAIT_INTERVAL,
     DEFAULT_ATTRIBUTION_MODEL,
     ATTRIBUTION_RENAMING_MAPPING,
     DOWNLOAD_FIELDS,
     DOWNLOAD_SOURCE,
-    FIELDS_RENAMING_MAPPING,
+    CLICKHOUSE_VISITS_FIELDS,
+    CLICKHOUSE_EVENTS_FIELDS,
 )
+from pipeline.layout import FORMATS, PARTITION_KEYS, check_compression, partition_values
 from utils.utils import fprint
-from logs_api.logs_api import LogsAPI, OperationResult
+from utils.fields import get_field_registry
+from utils.metrics import METRICS, add_metrics_arguments, start_metrics
+from utils.profiler import add_profile_arguments, start_profiling
 
 
 def validate_iso_date(date_str: str):
@@ -38,155 +39,395 @@ def validate_args(args):
     ):
         print("Error: you cannot use -r at the same time as -f and -t")
         sys.exit(1)
+    if args.report_id is not None and args.sources:
+        print("Error: you cannot use -r at the same time as -s")
+        sys.exit(1)
+    if (args.format != "tsv" or args.compress) and not args.partition_by:
+        print("Error: --format and --compress are used with --partition-by")
+        sys.exit(1)
+    if args.partition_by:
+        try:
+            check_compression(args.format, args.compress)
+        except ValueError as e:
+            print(f"Error: {e}")
+            sys.exit(1)
     if args.report_id is None and (args.from_date is None or args.to_date is None):
         print("Error: you must specify either -r or both -f and -t.")
         sys.exit(1)
 
 
-arg_parser = argparse.ArgumentParser(
-    description="Downloads Yandex Metrika logs and saves them in TSV format"
-)
-arg_parser.add_argument(
-    "-c", "--counter-id", type=int, required=True, help="YM counter ID"
-)
-arg_parser.add_argument(
-    "-r", "--report-id", type=int, help="download a ready-made report with ID"
-)
-arg_parser.add_argument(
-    "-f",
-    "--from-date",
-    type=validate_iso_date,
-    help="start date in ISO format (YYYY-MM-DD)",
-)
-arg_parser.add_argument(
-    "-t",
-    "--to-date",
-    type=validate_iso_date,
-    help="end date in ISO format (YYYY-MM-DD)",
-)
-arg_parser.add_argument(
-    "-R", "--rename-fields", action="store_true", help="rename field names"
-)
-arg_parser.add_argument("-o", "--output-file", type=str, help="output file name")
-arg_parser.add_argument(
-    "-d",
-    "--dry-run",
-    action="store_true",
-    help="only to check if the report can be created",
-)
-args = arg_parser.parse_args()
-validate_args(args)
+DESCRIPTION = "Downloads Yandex Metrika logs and saves them in TSV format"
 
-load_dotenv()
-AUTH_TOKEN = os.getenv("YM_AUTH_TOKEN")
-if not AUTH_TOKEN:
-    print("Environment variable `YM_AUTH_TOKEN` is missing", file=sys.stderr)
-    exit(1)
 
-output_fname = (
-    args.output_file or f"{args.counter_id}_{args.from_date}_{args.to_date}.tsv"
-)
+def add_arguments(arg_parser: argparse.ArgumentParser):
+    arg_parser.add_argument(
+        "-c", "--counter-id", type=int, required=True, help="YM counter ID"
+    )
+    arg_parser.add_argument(
+        "-r", "--report-id", type=int, help="download a ready-made report with ID"
+    )
+    arg_parser.add_argument(
+        "-f",
+        "--from-date",
+        type=validate_iso_date,
+        help="start date in ISO format (YYYY-MM-DD)",
+    )
+    arg_parser.add_argument(
+        "-t",
+        "--to-date",
+        type=validate_iso_date,
+        help="end date in ISO format (YYYY-MM-DD)",
+    )
+    arg_parser.add_argument(
+        "-s",
+        "--source",
+        dest="sources",
+        choices=["visits", "hits"],
+        action="append",
+        help="data source, ordered with the fields of its Clickhouse table, can be repeated "
+        "to order visits and hits at once (default: DOWNLOAD_SOURCE with DOWNLOAD_FIELDS)",
+    )
+    arg_parser.add_argument(
+        "-R", "--rename-fields", action="store_true", help="rename field names"
+    )
+    arg_parser.add_argument(
+        "-o",
+        "--output-file",
+        type=str,
+        help="output file name, `{source}` in it is replaced with the source",
+    )
+    arg_parser.add_argument(
+        "--partition-by",
+        choices=PARTITION_KEYS,
+        help="split the rows by day or by month into DIR/date=…/ or DIR/month=…/ "
+        "directories, -o sets DIR",
+    )
+    arg_parser.add_argument(
+        "--format",
+        choices=FORMATS,
+        default="tsv",
+        help="file format of the partitions (default: %(default)s)",
+    )
+    arg_parser.add_argument(
+        "--compress",
+        metavar="CODEC",
+        type=str,
+        help="compression of the partitions: gzip, bz2, xz for TSV; snappy, gzip, zstd for Parquet",
+    )
+    arg_parser.add_argument(
+        "-d",
+        "--dry-run",
+        action="store_true",
+        help="only to check if the report can be created",
+    )
+    arg_parser.add_argument(
+        "--reuse",
+        action="store_true",
+        help="use an already ordered report with the same parameters, if there is one",
+    )
+    arg_parser.add_argument(
+        "--clean",
+        action="store_true",
+        help="delete the report from the server once it is saved, to free the quota",
+    )
+    arg_parser.add_argument(
+        "--wait-for-quota",
+        action="store_true",
+        help="delay ordering until the storage quota has room for the report",
+    )
+    add_metrics_arguments(arg_parser)
+    add_profile_arguments(arg_parser)
 
-if os.path.exists(output_fname):
-    print(f"Output file already exists: {output_fname}", file=sys.stderr)
-    exit(1)
 
+def source_fields(source: str | None) -> list[str]:
+    """Fields to order: `DOWNLOAD_FIELDS` without `-s`, otherwise the ones of
+    the Clickhouse table of the source, whatever `DOWNLOAD_SOURCE` is."""
+    if source is None:
+        return DOWNLOAD_FIELDS
+    return CLICKHOUSE_VISITS_FIELDS if source == "visits" else CLICKHOUSE_EVENTS_FIELDS
 
-if DEFAULT_ATTRIBUTION_MODEL not in ATTRIBUTION_RENAMING_MAPPING.keys():
-    print(
-        f"`DEFAULT_ATTRIBUTION_MODEL` must be one of: {', '.join(ATTRIBUTION_RENAMING_MAPPING.keys())}",
-        file=sys.stderr,
-    )
-    exit(1)
 
-report_fields = [
-    f.replace("<attr>", DEFAULT_ATTRIBUTION_MODEL) for f in DOWNLOAD_FIELDS
-]
+def output_filename(args, source: str, start_date: str, end_date: str, several: bool) -> str:
+    """Output file name, or the directory of the partitions with `--partition-by`."""
+    extension = "" if args.partition_by else ".tsv"
+    if args.output_file:
+        return args.output_file.replace("{source}", source)
+    if several:
+        return f"{args.counter_id}_{source}_{start_date}_{end_date}{extension}"
+    return f"{args.counter_id}_{start_date}_{end_date}{extension}"
+
+
+def date_column(
+    source: str, report_fields: list[str], df_columns: list[str], renamed: bool
+) -> str | None:
+    """Name of the `date` column in the saved files, if the report has it."""
+    date_field = "ym:s:date" if source == "visits" else "ym:pv:date"
+    if date_field not in report_fields:
+        return None
+    return (df_columns if renamed else report_fields)[report_fields.index(date_field)]
+
+
+def save_report(
+    ym,
+    request_id: int,
+    source: str,
+    report_fields: list[str],
+    df_columns: list[str],
+    output_fname: str,
+    args,
+    label: str = "",
+):
+    """Wait for the report, save it to the file and clean it if asked.
+
+    With a `label` the messages are printed as separate lines starting with
+    it, for reports saved at the same time.
+    """
+    import pandas as pd
+    from humanize import naturaldelta, naturalsize
+    from logs_api.logs_api import OperationResult
+    from pipeline.layout import PartitionedWriter
+    from pipeline.pipeline import clean_report, iter_report_parts, wait_for_report
+
+    def log(line: str):
+        print(f"{label}: {line}" if label else line, flush=True)
 
-df_columns = []
-for field in report_fields:
-    if field in FIELDS_RENAMING_MAPPING:
-        df_columns.append(FIELDS_RENAMING_MAPPING[field])
+    progress = log if label else fprint
+    waited = False
+
+    def print_waiting(elapsed_time: float):
+        nonlocal waited
+        waited = True
+        elapsed_time = naturaldelta(dt.timedelta(seconds=elapsed_time))
+        progress(f"Waiting for report. It's been {elapsed_time}…")
+
+    report_info = wait_for_report(ym, request_id, WAIT_INTERVAL, on_wait=print_waiting)
+    if waited and not label:
+        print()
+
+    parts_len = len(report_info["parts"])
+    report_size = report_info["size"]
+    log(f"Number of parts in the report: {parts_len}")
+    log(f"Report size: {naturalsize(report_size, binary=True)}")
+
+    writer = None
+    if args.partition_by:
+        writer = PartitionedWriter(
+            output_fname,
+            date_column(source, report_fields, df_columns, args.rename_fields),
+            key=args.partition_by,
+            fmt=args.format,
+            compression=args.compress,
+        )
+
+    progress(f"Part 1/{parts_len}: downloading")
+    for part in iter_report_parts(ym, request_id, report_info):
+        part_num = part.number
+        progress(f"Part {part_num}/{parts_len}: converting")
+        with METRICS.stage("convert") as stage:
+            df = pd.DataFrame(part.rows, columns=part.columns).reindex(columns=report_fields)
+            if args.rename_fields:
+                df.rename(columns=dict(zip(report_fields, df_columns)), inplace=True)
+            stage.rows += len(df)
+        progress(f"Part {part_num}/{parts_len}: saving")
+        with METRICS.stage("write") as stage:
+            if writer:
+                writer.write(df)
+            elif part_num == 1:
+                df.to_csv(output_fname, sep="\t", index=False, header=True, mode="w")
+            else:
+                df.to_csv(output_fname, sep="\t", index=False, header=False, mode="a")
+            stage.rows += len(df)
+
+        progress(f"Part {part_num}/{parts_len}: done")
+        if part_num < parts_len:
+            progress(f"Part {part_num + 1}/{parts_len}: downloading")
+
+    if not label:
+        print()
+    if writer:
+        # Synced to disk, the report can be cleaned
+        partitions = writer.close()
+        log(f"The report is saved in {output_fname}, partitions: {len(partitions)}")
     else:
-        print(f"Field `{field}` of DOWNLOAD_FIELDS is not available for renaming")
-        exit(1)
+        log(f"The report is saved in {output_fname}")
 
-if not args.report_id:
-    ym = LogsAPI(
-        fields=report_fields,
-        auth_token=AUTH_TOKEN,
-        counter_id=args.counter_id,
-        start_date=args.from_date,
-        end_date=args.to_date,
-        source=DOWNLOAD_SOURCE,
-    )
-    if args.dry_run:
-        result: OperationResult = ym.check_reporting_capability()
+    if args.clean and not writer:
+        # Make sure the file is on disk before the only other copy is gone
+        with open(output_fname, "rb") as f:
+            os.fsync(f.fileno())
+    if args.clean:
+        result: OperationResult = clean_report(ym, request_id)
         if result.success:
-            print("Yes, a report can be created.")
-            exit(0)
+            log(f"Report #{request_id} has been deleted from the server")
         else:
-            print(f"The report cannot be created. Error:\n\n{result.error}\n")
+            print(f"Can't delete report #{request_id}. Error:\n\n{result.error}\n", file=sys.stderr)
             exit(1)
 
-    print("Ordering report…")
-    request_id = ym.create_report()
-else:
-    ym = LogsAPI(auth_token=AUTH_TOKEN, counter_id=args.counter_id)
-    request_id = args.report_id
 
-    try:
-        info = ym.get_report_info(request_id)
-    except Exception as e:
+def main(args):
+    from concurrent.futures import ThreadPoolExecutor, wait
+    from dotenv import load_dotenv
+    from humanize import naturalsize
+    from logs_api.logs_api import LogsAPI, OperationResult
+    from logs_api.quota import estimate_report_size, report_days
+    from pipeline.pipeline import find_report, order_report, wait_for_quota
+
+    validate_args(args)
+    start_metrics(args)
+    start_profiling(args)
+
+    load_dotenv()
+    auth_token = os.getenv("YM_AUTH_TOKEN")
+    if not auth_token:
+        print("Environment variable `YM_AUTH_TOKEN` is missing", file=sys.stderr)
+        exit(1)
+
+    if DEFAULT_ATTRIBUTION_MODEL not in ATTRIBUTION_RENAMING_MAPPING.keys():
         print(
-            f"It appears that report #{request_id} does not exist. "
-            f"An error occurred while retrieving information about it:\n\n{e}\n"
+            f"`DEFAULT_ATTRIBUTION_MODEL` must be one of: {', '.join(ATTRIBUTION_RENAMING_MAPPING.keys())}",
+            file=sys.stderr,
         )
         exit(1)
 
-    start_date = info["log_request"]["date1"]
-    end_date = info["log_request"]["date2"]
-    output_fname = args.output_file or f"{args.counter_id}_{start_date}_{end_date}.tsv"
+    fields = get_field_registry()
 
-wait_counter: int = 0
+    def get_report_fields(source: str, ordered_fields: list[str]) -> tuple[list[str], list[str]]:
+        report_fields = [fields.expand(f, DEFAULT_ATTRIBUTION_MODEL) for f in ordered_fields]
+        df_columns, missing_fields = fields.renamed_names(report_fields)
+        if missing_fields:
+            print(f"Field `{missing_fields[0]}` of {source} fields is not available for renaming")
+            exit(1)
+        return report_fields, df_columns
 
-while True:
-    if ym.is_report_ready(request_id):
-        break
-    else:
-        elapsed_time = wait_counter * WAIT_INTERVAL
-        elapsed_time = dt.timedelta(seconds=elapsed_time)
-        elapsed_time = naturaldelta(elapsed_time)
-        fprint(f"Waiting for report. It's been {elapsed_time}…")
-        wait_counter += 1
-        time.sleep(WAIT_INTERVAL)
-
-if wait_counter > 0:
-    print()
-
-report_info = ym.get_report_info(request_id)
-parts = report_info["log_request"]["parts"]
-parts_len = len(parts)
-report_size = report_info["log_request"]["size"]
-print("Number of parts in the report:", parts_len)
-print("Report size:", naturalsize(report_size, binary=True))
-
-for part_num, part_info in enumerate(parts, start=1):
-    fprint(f"Part {part_num}/{parts_len}: downloading")
-    part_orig_num = part_info["part_number"]
-    part = ym.download_report_part(request_id, part_orig_num)
-    fprint(f"Part {part_num}/{parts_len}: converting")
-    part_dict = part().to_dicts()
-    df = pd.DataFrame(part_dict, columns=report_fields)
-    if args.rename_fields:
-        df.rename(columns=dict(zip(report_fields, df_columns)), inplace=True)
-    fprint(f"Part {part_num}/{parts_len}: saving")
-    if part_num == 1:
-        df.to_csv(output_fname, sep="\t", index=False, header=True, mode="w")
+    def check_output(source: str, output_fname: str, report_fields, df_columns, date1, date2):
+        if not args.partition_by:
+            if os.path.exists(output_fname):
+                print(f"Output file already exists: {output_fname}", file=sys.stderr)
+                exit(1)
+            return
+        if not date_column(source, report_fields, df_columns, args.rename_fields):
+            print(f"The {source} fields have no date to partition by", file=sys.stderr)
+            exit(1)
+        for value in partition_values(date1, date2, args.partition_by):
+            partition_dir = os.path.join(output_fname, f"{args.partition_by}={value}")
+            if os.path.exists(partition_dir):
+                print(f"Partition already exists: {partition_dir}", file=sys.stderr)
+                exit(1)
+
+    # Source -> (LogsAPI, request ID, source, report fields, file columns, output file)
+    reports = {}
+
+    if not args.report_id:
+        sources = list(dict.fromkeys(args.sources or [DOWNLOAD_SOURCE]))
+        several = len(sources) > 1
+        if several and args.output_file and "{source}" not in args.output_file:
+            print("With several sources -o must contain `{source}`", file=sys.stderr)
+            exit(1)
+
+        for source in sources:
+            # Without -s the configured download is made as it is
+            ordered_fields = source_fields(source if args.sources else None)
+            report_fields, df_columns = get_report_fields(source, ordered_fields)
+            output_fname = output_filename(args, source, args.from_date, args.to_date, several)
+            check_output(
+                source, output_fname, report_fields, df_columns, args.from_date, args.to_date
+            )
+            ym = LogsAPI(
+                fields=report_fields,
+                auth_token=auth_token,
+                counter_id=args.counter_id,
+                start_date=args.from_date,
+                end_date=args.to_date,
+                source=source,
+            )
+            reports[source] = [ym, None, source, report_fields, df_columns, output_fname]
+
+        if args.dry_run:
+            failed = False
+            for source, (ym, *_) in reports.items():
+                prefix = f"{source}: " if several else ""
+                result: OperationResult = ym.check_reporting_capability()
+                if result.success:
+                    print(f"{prefix}Yes, a report can be created.")
+                else:
+                    failed = True
+                    print(f"{prefix}The report cannot be created. Error:\n\n{result.error}\n")
+            exit(1 if failed else 0)
+
+        # Reports are ordered one after another, so that the quota check of
+        # each next report counts the previous ones as queued
+        for source, report in reports.items():
+            ym = report[0]
+            prefix = f"{source}: " if several else ""
+            request_id = find_report(ym) if args.reuse else None
+            if request_id:
+                print(f"{prefix}Using the already ordered report #{request_id}")
+            else:
+                if args.wait_for_quota:
+                    all_reports = ym.get_all_reports_info()["requests"]
+                    days = report_days({"date1": args.from_date, "date2": args.to_date})
+                    expected_size = estimate_report_size(all_reports, source, days)
+                    print(
+                        f"{prefix}Expected report size: {naturalsize(expected_size, binary=True)}"
+                    )
+
+                    waited = False
+
+                    def print_quota(free: int):
+                        nonlocal waited
+                        waited = True
+                        fprint(
+                            f"Waiting for the quota. Free: {naturalsize(max(free, 0), binary=True)}…"
+                        )
+
+                    wait_for_quota(
+                        ym, LOGS_API_QUOTA, expected_size, QUOTA_WAIT_INTERVAL, on_wait=print_quota
+                    )
+                    if waited:
+                        print()
+                print(f"{prefix}Ordering report…")
+                request_id = order_report(ym)
+            report[1] = request_id
     else:
-        df.to_csv(output_fname, sep="\t", index=False, header=False, mode="a")
+        ym = LogsAPI(auth_token=auth_token, counter_id=args.counter_id)
+        request_id = args.report_id
+
+        try:
+            info = ym.get_report_info(request_id)
+        except Exception as e:
+            print(
+                f"It appears that report #{request_id} does not exist. "
+                f"An error occurred while retrieving information about it:\n\n{e}\n"
+            )
+            exit(1)
+
+        source = info["log_request"]["source"]
+        start_date = info["log_request"]["date1"]
+        end_date = info["log_request"]["date2"]
+        # The fields the report was ordered with
+        ordered_fields = info["log_request"].get("fields") or source_fields(source)
+        report_fields, df_columns = get_report_fields(source, ordered_fields)
+        output_fname = output_filename(args, source, start_date, end_date, several=False)
+        check_output(source, output_fname, report_fields, df_columns, start_date, end_date)
+        reports[source] = [ym, request_id, source, report_fields, df_columns, output_fname]
+
+    if len(reports) == 1:
+        save_report(*next(iter(reports.values())), args)
+        return
+
+    # The queue waits and downloads of the sources overlap
+    with ThreadPoolExecutor(len(reports), thread_name_prefix="source") as executor:
+        futures = [
+            executor.submit(save_report, *report, args, label=source)
+            for source, report in reports.items()
+        ]
+        wait(futures)
+    for future in futures:
+        # Failures end with `exit()`, which is raised here
+        future.result()
 
-    fprint(f"Part {part_num}/{parts_len}: done")
 
-print()
-print(f"The report is saved in {output_fname}")
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description=DESCRIPTION)
+    add_arguments(arg_parser)
+    main(arg_parser.parse_args())
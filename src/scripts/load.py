@@ -0,0 +1,163 @@
+import os
+import sys
+import argparse
+import csv
+import time
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from db.clickhouse.convert import make_row_converter
+from db.clickhouse.batching import BATCH_MODES, make_batch_policy
+from utils.utils import fprint, open_input_file
+from utils.fields import get_field_registry
+from utils.metrics import METRICS, add_metrics_arguments, start_metrics
+from utils.profiler import add_profile_arguments, start_profiling
+
+from config import (
+    CLICKHOUSE_BATCH_SIZE,
+    CLICKHOUSE_BATCH_MODE,
+    CLICKHOUSE_BATCH_BYTES,
+    CLICKHOUSE_ADAPTIVE_TARGET_SECONDS,
+    CLICKHOUSE_ADAPTIVE_MIN_ROWS,
+    CLICKHOUSE_ADAPTIVE_MAX_ROWS,
+)
+
+DESCRIPTION = "Loads a Logs API TSV file into a local DuckDB or SQLite database"
+
+SINKS = ["duckdb", "sqlite", "tsv"]
+
+
+def add_arguments(arg_parser: argparse.ArgumentParser):
+    arg_parser.add_argument("tsv_file", type=str, help="TSV file, can be compressed")
+    arg_parser.add_argument(
+        "-t",
+        "--to",
+        dest="sink",
+        choices=SINKS,
+        default="duckdb",
+        help="where to load the data (default: %(default)s)",
+    )
+    arg_parser.add_argument(
+        "-o",
+        "--output",
+        metavar="PATH",
+        type=str,
+        required=True,
+        help="database file, or a TSV file for `tsv`",
+    )
+    arg_parser.add_argument(
+        "--table",
+        type=str,
+        default="visits",
+        help="table to load the data into, created if missing (default: %(default)s)",
+    )
+    arg_parser.add_argument(
+        "-R",
+        "--renamed-fields",
+        action="store_true",
+        help="the file uses renamed fields",
+    )
+    arg_parser.add_argument(
+        "-s",
+        "--data-source",
+        choices=["visits", "hits"],
+        help="which data the file has, required with -R: visits or events (hits)",
+    )
+    arg_parser.add_argument(
+        "-b",
+        "--batch-mode",
+        choices=BATCH_MODES,
+        default=CLICKHOUSE_BATCH_MODE,
+        help="how to split the input into batches (default: %(default)s)",
+    )
+    add_metrics_arguments(arg_parser)
+    add_profile_arguments(arg_parser)
+
+
+def make_sink(args):
+    from pipeline.sinks import DuckDBSink, SqliteSink, TsvSink
+
+    if args.sink == "duckdb":
+        return DuckDBSink(args.output, args.table)
+    if args.sink == "sqlite":
+        return SqliteSink(args.output, args.table)
+    return TsvSink(args.output)
+
+
+def main(args):
+    from pipeline.pipeline import RowBatch, iter_policy_batches
+
+    if args.renamed_fields and not args.data_source:
+        print("--renamed-fields requires --data-source", file=sys.stderr)
+        exit(1)
+    start_metrics(args)
+    start_profiling(args)
+    fields = get_field_registry()
+
+    with open_input_file(args.tsv_file) as (f, _):
+        reader = csv.reader(f, delimiter="\t")
+        file_columns = next(reader)
+
+    file_columns_types = []
+    for file_col in file_columns:
+        if args.renamed_fields:
+            field = fields.by_renamed.get((args.data_source, file_col))
+        else:
+            field = fields.by_name.get(file_col)
+        if not field or not field.type:
+            print(f"Unknown field `{file_col}`", file=sys.stderr)
+            exit(1)
+        file_columns_types.append(field.type)
+    convert_row = make_row_converter(file_columns_types)
+
+    try:
+        batch_policy = make_batch_policy(
+            mode=args.batch_mode,
+            batch_size=CLICKHOUSE_BATCH_SIZE,
+            batch_bytes=CLICKHOUSE_BATCH_BYTES,
+            adaptive_target_seconds=CLICKHOUSE_ADAPTIVE_TARGET_SECONDS,
+            adaptive_min_rows=CLICKHOUSE_ADAPTIVE_MIN_ROWS,
+            adaptive_max_rows=CLICKHOUSE_ADAPTIVE_MAX_ROWS,
+        )
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        exit(1)
+    print(f"Batch size: {batch_policy.describe()}")
+
+    try:
+        sink = make_sink(args)
+        sink.open(file_columns, file_columns_types)
+    except Exception as e:
+        print(f"Can't open `{args.output}`:\n\n{e}\n", file=sys.stderr)
+        exit(1)
+
+    def write_batch(batch: RowBatch):
+        rows_num = len(batch.rows)
+        started_at = time.monotonic()
+        METRICS.record_stage("convert", started_at - batch.started_at, rows_num, batch.size)
+        try:
+            sink.write_batch(batch.rows)
+        except Exception as e:
+            print(f"\nError while loading data:\n\n{e}\n", file=sys.stderr)
+            exit(1)
+        elapsed = time.monotonic() - started_at
+        METRICS.record_stage("write", elapsed, rows_num, batch.size)
+        batch_policy.record_insert(rows_num, batch.size, elapsed)
+
+    with sink, open_input_file(args.tsv_file) as (f, _):
+        reader = csv.reader(f, delimiter="\t")
+        next(reader)
+
+        row_num = 0
+        for batch in iter_policy_batches(reader, convert_row, batch_policy):
+            write_batch(batch)
+            row_num = batch.last_row
+            fprint(f"Loading data: {row_num} rows")
+
+    print(f"\nDone. Rows loaded into `{args.output}`: {row_num}")
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description=DESCRIPTION)
+    add_arguments(arg_parser)
+    main(arg_parser.parse_args())
@@ -0,0 +1,122 @@
+import os
+import sys
+import csv
+import argparse
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from db.clickhouse.profiling import ColumnProfile
+from utils.utils import fprint, open_input_file
+from utils.fields import get_field_registry
+from utils.profiler import add_profile_arguments, start_profiling
+
+# How often to update the progress line
+PROGRESS_EVERY_ROWS = 100_000
+
+DESCRIPTION = "Profiles a downloaded TSV file and recommends Clickhouse column types"
+
+
+def add_arguments(arg_parser: argparse.ArgumentParser):
+    arg_parser.add_argument("tsv_file", type=str, help="TSV file, can be compressed")
+    arg_parser.add_argument(
+        "-R",
+        "--renamed-fields",
+        action="store_true",
+        help="the file uses renamed fields",
+    )
+    arg_parser.add_argument(
+        "-s",
+        "--data-source",
+        choices=["visits", "hits"],
+        help="which data the file has, required with -R: visits or events (hits)",
+    )
+    arg_parser.add_argument(
+        "-n",
+        "--max-rows",
+        metavar="N",
+        type=int,
+        help="profile only the first N rows",
+    )
+    arg_parser.add_argument(
+        "-f",
+        "--format",
+        choices=["table", "types", "ddl"],
+        default="table",
+        help="report as a table, a `columns_types` mapping or column definitions (default: %(default)s)",
+    )
+    add_profile_arguments(arg_parser)
+
+
+def main(args):
+    from tabulate import tabulate
+
+    if args.renamed_fields and not args.data_source:
+        print("--renamed-fields requires --data-source", file=sys.stderr)
+        exit(1)
+    start_profiling(args)
+    fields = get_field_registry()
+
+    with open_input_file(args.tsv_file) as (f, _):
+        reader = csv.reader(f, delimiter="\t")
+        file_columns = next(reader)
+
+        profiles = []
+        for file_col in file_columns:
+            if args.renamed_fields:
+                field = fields.by_renamed.get((args.data_source, file_col))
+            else:
+                field = fields.by_name.get(file_col)
+            if not field or not field.type:
+                print(f"Unknown field `{file_col}`", file=sys.stderr)
+                exit(1)
+            profiles.append(ColumnProfile(field.name, field.type))
+
+        row_num = 0
+        for row in reader:
+            for profile, value in zip(profiles, row):
+                profile.add(value)
+            row_num += 1
+            if row_num % PROGRESS_EVERY_ROWS == 0:
+                fprint(f"Profiling: {row_num} rows", file=sys.stderr)
+            if args.max_rows and row_num >= args.max_rows:
+                break
+
+    if row_num >= PROGRESS_EVERY_ROWS:
+        print(file=sys.stderr)
+    print(f"Rows profiled: {row_num}\n", file=sys.stderr)
+
+    if args.format == "table":
+        table = []
+        for file_col, profile in zip(file_columns, profiles):
+            distinct = profile.distinct.count()
+            table.append(
+                {
+                    "Field": file_col,
+                    "Type": profile.column_type,
+                    "Recommended": profile.recommend_type(),
+                    "Null %": round(profile.null_rate * 100, 2),
+                    "Distinct": distinct if profile.distinct.is_exact else f"~{distinct}",
+                    "Min": profile.min_value,
+                    "Max": profile.max_value,
+                    "Avg len": round(profile.avg_length, 1),
+                    "Max len": profile.max_length,
+                }
+            )
+        print(tabulate(table, headers="keys", tablefmt="pipe"))
+    elif args.format == "types":
+        print("columns_types = {")
+        for profile in profiles:
+            print(f'    "{profile.field}": "{profile.recommend_type()}",')
+        print("}")
+    else:
+        definitions = [
+            f"{file_col} {profile.recommend_type()}"
+            for file_col, profile in zip(file_columns, profiles)
+        ]
+        print(",\n".join(definitions))
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description=DESCRIPTION)
+    add_arguments(arg_parser)
+    main(arg_parser.parse_args())
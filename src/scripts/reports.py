@@ -1,96 +1,216 @@
 import argparse
 import os
 import sys
-
-from dotenv import load_dotenv
-from humanize import naturalsize
-from tabulate import tabulate
+import datetime as dt
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 
-from logs_api.logs_api import LogsAPI, OperationResult
-
-arg_parser = argparse.ArgumentParser(
-    description="Utility for working with existing Yandex Metrika Logs API reports"
-)
-arg_parser.add_argument(
-    "-c", "--counter-id", type=int, required=True, help="YM counter ID"
-)
-
-arg_group = arg_parser.add_mutually_exclusive_group(required=True)
-arg_group.add_argument("-l", "--list", action="store_true", help="list all reports")
-arg_group.add_argument(
-    "-d", "--delete", metavar="ID", type=int, help="delete report by ID"
-)
-arg_group.add_argument(
-    "-D", "--delete-all", action="store_true", help="delete all reports"
-)
-
-args = arg_parser.parse_args()
-
-load_dotenv()
-AUTH_TOKEN = os.getenv("YM_AUTH_TOKEN")
-if not AUTH_TOKEN:
-    print("Environment variable `YM_AUTH_TOKEN` is missing", file=sys.stderr)
-    exit(1)
-
-ym = LogsAPI(auth_token=AUTH_TOKEN, counter_id=args.counter_id)
-
-if args.list:
-    print("Getting a list of reports…")
-    reports = ym.get_all_reports_info()
-    reports = reports["requests"]
-    reports_len = len(reports)
-
-    print(f"Reports found: {reports_len}\n")
-    if reports_len == 0:
-        exit(0)
-
-    table = []
-    total_size = 0
-
-    for report in reports:
-        table.append(
-            {
-                "ID": report["request_id"],
-                "Start date": report["date1"],
-                "End date": report["date2"],
-                "Attrib": report["attribution"],
-                "# fields": len(report["fields"]),
-                "# parts": len(report["parts"]),
-                "Size": naturalsize(report["size"], binary=True),
-                "Status": report["status"],
-            }
-        )
-        total_size += report["size"]
-
-    print(tabulate(table, headers="keys", tablefmt="pipe"))
-    print()
-    print("Total size:", naturalsize(total_size, binary=True))
-
-if args.delete:
-    report_id = args.delete
-    result: OperationResult = ym.delete_report(report_id)
-    if result.success:
-        print(f"Report #{report_id} has been successfully deleted")
-    else:
-        print(f"Can't delete the report. Error:\n\n{result.error}\n")
-
-if args.delete_all:
-    print("Getting a list of reports…")
-    reports = ym.get_all_reports_info()
-    reports = reports["requests"]
-    reports_len = len(reports)
-
-    print(f"Reports found: {reports_len}\n")
-    if reports_len == 0:
-        exit(0)
-
-    for report in reports:
-        report_id = report["request_id"]
-        print(f"Deleting report #{report_id}… ", end="", flush=True)
+from utils.metrics import add_metrics_arguments, start_metrics
+from utils.profiler import add_profile_arguments, start_profiling
+
+DESCRIPTION = "Utility for working with existing Yandex Metrika Logs API reports"
+
+STATUSES = [
+    "created",
+    "canceled",
+    "processed",
+    "cleaned_by_user",
+    "cleaned_automatically_as_too_old",
+    "processing_failed",
+    "awaiting_retry",
+]
+
+
+def add_arguments(arg_parser: argparse.ArgumentParser):
+    arg_parser.add_argument(
+        "-c", "--counter-id", type=int, required=True, help="YM counter ID"
+    )
+
+    arg_group = arg_parser.add_mutually_exclusive_group(required=True)
+    arg_group.add_argument("-l", "--list", action="store_true", help="list all reports")
+    arg_group.add_argument(
+        "-d", "--delete", metavar="ID", type=int, help="delete report by ID"
+    )
+    arg_group.add_argument(
+        "-D",
+        "--delete-all",
+        action="store_true",
+        help="delete all reports, or only the ones matching the filters",
+    )
+
+    filter_group = arg_parser.add_argument_group("filters for -l and -D")
+    filter_group.add_argument(
+        "--status",
+        dest="statuses",
+        choices=STATUSES,
+        action="append",
+        help="report status, can be repeated",
+    )
+    filter_group.add_argument(
+        "--older-than",
+        metavar="DAYS",
+        type=int,
+        help="the report period ended at least DAYS days ago",
+    )
+    filter_group.add_argument(
+        "--from-date",
+        metavar="YYYY-MM-DD",
+        type=dt.date.fromisoformat,
+        help="the report period starts on or after the date",
+    )
+    filter_group.add_argument(
+        "--to-date",
+        metavar="YYYY-MM-DD",
+        type=dt.date.fromisoformat,
+        help="the report period ends on or before the date",
+    )
+    filter_group.add_argument(
+        "--min-size",
+        metavar="MIB",
+        type=float,
+        help="the report is at least MIB mebibytes",
+    )
+    filter_group.add_argument(
+        "--downloaded",
+        metavar="DIR",
+        type=str,
+        help="the report has been saved to DIR by download_logs.py",
+    )
+
+    arg_parser.add_argument(
+        "-j",
+        "--jobs",
+        metavar="N",
+        type=int,
+        default=3,
+        help="how many reports to delete at once (default: %(default)s)",
+    )
+    arg_parser.add_argument(
+        "--rate",
+        metavar="RPS",
+        type=float,
+        default=5,
+        help="maximum number of delete requests per second (default: %(default)s)",
+    )
+    arg_parser.add_argument(
+        "-n",
+        "--dry-run",
+        action="store_true",
+        help="only show the reports that would be deleted",
+    )
+    add_metrics_arguments(arg_parser)
+    add_profile_arguments(arg_parser)
+
+
+def main(args):
+    from dotenv import load_dotenv
+    from humanize import naturalsize
+    from tabulate import tabulate
+    from logs_api.logs_api import LogsAPI, OperationResult
+    from logs_api.cleanup import ReportFilter, delete_reports, is_deletable
+    from logs_api.quota import used_quota
+
+    start_metrics(args)
+    start_profiling(args)
+
+    load_dotenv()
+    auth_token = os.getenv("YM_AUTH_TOKEN")
+    if not auth_token:
+        print("Environment variable `YM_AUTH_TOKEN` is missing", file=sys.stderr)
+        exit(1)
+
+    def make_api():
+        return LogsAPI(auth_token=auth_token, counter_id=args.counter_id)
+
+    ym = make_api()
+    report_filter = ReportFilter(
+        statuses=args.statuses,
+        older_than_days=args.older_than,
+        from_date=args.from_date,
+        to_date=args.to_date,
+        min_size=int(args.min_size * 1024 * 1024) if args.min_size else None,
+        downloaded_dir=args.downloaded,
+    )
+
+    if args.list:
+        print("Getting a list of reports…")
+        all_reports = ym.get_all_reports_info()["requests"]
+        reports = [r for r in all_reports if report_filter.matches(r)]
+        reports_len = len(reports)
+
+        print(f"Reports found: {reports_len}\n")
+        if reports_len == 0:
+            exit(0)
+
+        table = []
+        total_size = 0
+
+        for report in reports:
+            table.append(
+                {
+                    "ID": report["request_id"],
+                    "Start date": report["date1"],
+                    "End date": report["date2"],
+                    "Attrib": report["attribution"],
+                    "# fields": len(report["fields"]),
+                    "# parts": len(report["parts"]),
+                    "Size": naturalsize(report["size"], binary=True),
+                    "Status": report["status"],
+                }
+            )
+            total_size += report["size"]
+
+        print(tabulate(table, headers="keys", tablefmt="pipe"))
+        print()
+        print("Total size:", naturalsize(total_size, binary=True))
+        print("Quota used:", naturalsize(used_quota(all_reports), binary=True))
+
+    if args.delete:
+        report_id = args.delete
         result: OperationResult = ym.delete_report(report_id)
         if result.success:
-            print("ok")
+            print(f"Report #{report_id} has been successfully deleted")
         else:
-            print(f"FAILED. Error:\n{result.error}\n")
+            print(f"Can't delete the report. Error:\n\n{result.error}\n")
+
+    if args.delete_all:
+        print("Getting a list of reports…")
+        reports = ym.get_all_reports_info()
+        reports = [
+            r
+            for r in reports["requests"]
+            if is_deletable(r) and report_filter.matches(r)
+        ]
+        reports_len = len(reports)
+
+        print(f"Reports to delete: {reports_len}\n")
+        if reports_len == 0:
+            exit(0)
+
+        if args.dry_run:
+            for report in reports:
+                print(
+                    f"#{report['request_id']}: {report['date1']}..{report['date2']}, "
+                    f"{naturalsize(report['size'], binary=True)}, {report['status']}"
+                )
+            exit(0)
+
+        failed = 0
+        results = delete_reports(make_api, reports, jobs=args.jobs, rate=args.rate)
+        for report, result in results:
+            report_id = report["request_id"]
+            if result.success:
+                print(f"Report #{report_id} has been deleted")
+            else:
+                failed += 1
+                print(f"Can't delete report #{report_id}. Error:\n{result.error}\n")
+
+        print(f"\nDeleted: {reports_len - failed}, failed: {failed}")
+        if failed:
+            exit(1)
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description=DESCRIPTION)
+    add_arguments(arg_parser)
+    main(arg_parser.parse_args())
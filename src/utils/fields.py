@@ -0,0 +1,151 @@
+import os
+import sys
+import pickle
+import hashlib
+import importlib.util
+from dataclasses import dataclass
+
+# Bump when `Field` or the way the registry is built changes, so that stale
+# caches are not picked up
+REGISTRY_VERSION = 1
+
+CACHE_DIR = os.path.join(
+    os.getenv("XDG_CACHE_HOME", os.path.expanduser("~/.cache")), "yandex-metrika-logs"
+)
+
+SOURCES_BY_PREFIX = {
+    "ym:s:": "visits",
+    "ym:pv:": "hits",
+}
+
+
+@dataclass(frozen=True)
+class Field:
+    # API name, e.g. `ym:s:lastsignTrafficSource`
+    name: str
+    # Name after renaming, e.g. `lastsignTrafficSource`, or None if the field
+    # is missing from `FIELDS_RENAMING_MAPPING`
+    renamed: str | None
+    # Clickhouse type, or None if the field is missing from `columns_types`
+    type: str | None
+    # `visits` or `hits`
+    source: str
+    # Name with `<attr>`, e.g. `ym:s:<attr>TrafficSource`, for attribution variants
+    template: str | None = None
+    # Attribution model of the variant, e.g. `lastsign`
+    attribution: str | None = None
+
+
+class FieldRegistry:
+    """Metadata of all known fields with constant-time lookups by any name."""
+
+    def __init__(self, fields: list[Field]):
+        self.fields = fields
+        self.by_name = {field.name: field for field in fields}
+        # The same renamed names, e.g. `date`, exist in both sources
+        self.by_renamed: dict[tuple[str, str], Field] = {
+            (field.source, field.renamed): field for field in fields if field.renamed
+        }
+        self.variants: dict[tuple[str, str], Field] = {
+            (field.template, field.attribution): field
+            for field in fields
+            if field.template
+        }
+
+    def get(self, name: str, source: str) -> Field | None:
+        """Look up a field by its API name or its renamed name in a source."""
+        return self.by_name.get(name) or self.by_renamed.get((source, name))
+
+    def expand(self, name: str, attribution: str) -> str:
+        """Replace `<attr>` in a field name with the attribution model."""
+        if "<attr>" not in name:
+            return name
+        field = self.variants.get((name, attribution))
+        return field.name if field else name.replace("<attr>", attribution)
+
+    def renamed_names(self, names: list[str]) -> tuple[list[str], list[str]]:
+        """Renamed names of API fields, and the fields that can't be renamed."""
+        renamed, missing = [], []
+        for name in names:
+            field = self.by_name.get(name)
+            if field and field.renamed:
+                renamed.append(field.renamed)
+            else:
+                missing.append(name)
+        return renamed, missing
+
+
+def _source_of(name: str) -> str:
+    for prefix, source in SOURCES_BY_PREFIX.items():
+        if name.startswith(prefix):
+            return source
+    return ""
+
+
+def build_field_registry() -> FieldRegistry:
+    from config import ATTRIBUTION_RENAMING_MAPPING, FIELDS_RENAMING_MAPPING
+    from db.clickhouse.types import columns_types, columns_types_templates
+
+    templates = {}
+    for template in columns_types_templates:
+        if "<attr>" not in template:
+            continue
+        for attribution in ATTRIBUTION_RENAMING_MAPPING:
+            templates[template.replace("<attr>", attribution)] = (template, attribution)
+
+    fields = []
+    for name in columns_types.keys() | FIELDS_RENAMING_MAPPING.keys():
+        template, attribution = templates.get(name, (None, None))
+        fields.append(
+            Field(
+                name=name,
+                renamed=FIELDS_RENAMING_MAPPING.get(name),
+                type=columns_types.get(name),
+                source=_source_of(name),
+                template=template,
+                attribution=attribution,
+            )
+        )
+    fields.sort(key=lambda field: field.name)
+    return FieldRegistry(fields)
+
+
+def _config_hash() -> str:
+    """Hash of the files the registry is built from."""
+    digest = hashlib.sha1(str(REGISTRY_VERSION).encode())
+    # The modules are located without being imported, importing `types`
+    # is exactly what the cache saves
+    for module in ("config", "db.clickhouse.types"):
+        fname = importlib.util.find_spec(module).origin
+        with open(fname, "rb") as f:
+            digest.update(f.read())
+    return digest.hexdigest()[:16]
+
+
+_registry: FieldRegistry | None = None
+
+
+def get_field_registry() -> FieldRegistry:
+    """The registry is built once and cached on disk until the config changes."""
+    global _registry
+    if _registry is not None:
+        return _registry
+
+    cache_fname = os.path.join(CACHE_DIR, f"fields-{_config_hash()}.pickle")
+    try:
+        with open(cache_fname, "rb") as f:
+            _registry = FieldRegistry(pickle.load(f))
+        return _registry
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError):
+        pass
+
+    _registry = build_field_registry()
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        tmp_fname = f"{cache_fname}.{os.getpid()}.tmp"
+        with open(tmp_fname, "wb") as f:
+            pickle.dump(_registry.fields, f)
+        os.replace(tmp_fname, cache_fname)
+    except OSError as e:
+        print(f"Can't cache the field registry: {e}", file=sys.stderr)
+    return _registry
@@ -0,0 +1,250 @@
+"""Per-stage metrics of a pipeline run, exported as OpenMetrics text or JSON.
+
+Stages are timed with `METRICS.stage()`, the rows and bytes they process are
+counted on the yielded object:
+
+    with METRICS.stage("insert") as stage:
+        client.insert(table, batch)
+        stage.rows += len(batch)
+"""
+
+import os
+import sys
+import json
+import time
+import atexit
+import logging
+import argparse
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from dataclasses import dataclass
+
+PREFIX = "ym"
+
+SECONDS_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 900, 3600)
+
+HELP = {
+    "stage_seconds": "Duration of pipeline stage runs",
+    "stage_rows": "Rows processed by pipeline stages",
+    "stage_bytes": "Bytes processed by pipeline stages",
+    "api_request_seconds": "Latency of Logs API calls",
+    "api_requests": "Logs API calls by outcome",
+    "api_retries": "Logs API requests repeated by the client library",
+    "daemon_stages": "Job stages run by the daemon by outcome",
+}
+
+
+class Histogram:
+    def __init__(self, buckets: tuple = SECONDS_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative_counts(self) -> list[tuple[str, int]]:
+        result = []
+        total = 0
+        for bound, count in zip([*self.buckets, "+Inf"], self.counts):
+            total += count
+            result.append((str(bound), total))
+        return result
+
+
+@dataclass
+class StageRun:
+    rows: int = 0
+    bytes: int = 0
+
+
+def _labels_str(labels: tuple) -> str:
+    if not labels:
+        return ""
+    pairs = ",".join(f'{key}="{value}"' for key, value in labels)
+    return "{" + pairs + "}"
+
+
+class Metrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        # (name, labels) -> value, labels being a sorted tuple of pairs
+        self.counters: dict[tuple[str, tuple], float] = {}
+        self.histograms: dict[tuple[str, tuple], Histogram] = {}
+
+    def add(self, name: str, value: float = 1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            if key not in self.histograms:
+                self.histograms[key] = Histogram()
+            self.histograms[key].observe(value)
+
+    def record_stage(self, stage: str, seconds: float, rows: int = 0, size: int = 0):
+        self.observe("stage_seconds", seconds, stage=stage)
+        if rows:
+            self.add("stage_rows", rows, stage=stage)
+        if size:
+            self.add("stage_bytes", size, stage=stage)
+
+    @contextmanager
+    def stage(self, stage: str):
+        run = StageRun()
+        started_at = time.monotonic()
+        try:
+            yield run
+        finally:
+            self.record_stage(stage, time.monotonic() - started_at, run.rows, run.bytes)
+
+    def to_openmetrics(self) -> str:
+        lines = []
+        with self.lock:
+            families = {}
+            for (name, labels), value in sorted(self.counters.items()):
+                families.setdefault((name, "counter"), []).append((labels, value))
+            for (name, labels), hist in sorted(self.histograms.items()):
+                families.setdefault((name, "histogram"), []).append((labels, hist))
+
+            for (name, kind), samples in families.items():
+                full_name = f"{PREFIX}_{name}"
+                lines.append(f"# TYPE {full_name} {kind}")
+                if name in HELP:
+                    lines.append(f"# HELP {full_name} {HELP[name]}")
+                for labels, value in samples:
+                    if kind == "counter":
+                        lines.append(f"{full_name}_total{_labels_str(labels)} {value}")
+                        continue
+                    for bound, count in value.cumulative_counts():
+                        bucket_labels = _labels_str((*labels, ("le", bound)))
+                        lines.append(f"{full_name}_bucket{bucket_labels} {count}")
+                    lines.append(f"{full_name}_sum{_labels_str(labels)} {value.sum}")
+                    lines.append(f"{full_name}_count{_labels_str(labels)} {value.count}")
+        lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+    def to_json(self) -> dict:
+        """Summary by stage and by API method, with the throughput of stages."""
+        summary = {"stages": {}, "api": {}}
+        with self.lock:
+            for (name, labels), hist in self.histograms.items():
+                labels = dict(labels)
+                if name == "stage_seconds":
+                    section = summary["stages"].setdefault(labels["stage"], {})
+                elif name == "api_request_seconds":
+                    section = summary["api"].setdefault(labels["method"], {})
+                else:
+                    continue
+                section["calls"] = hist.count
+                section["seconds"] = round(hist.sum, 3)
+            for (name, labels), value in self.counters.items():
+                labels = dict(labels)
+                if name in ("stage_rows", "stage_bytes"):
+                    section = summary["stages"].setdefault(labels["stage"], {})
+                    section[name.removeprefix("stage_")] = value
+                elif name == "api_requests":
+                    section = summary["api"].setdefault(labels["method"], {})
+                    section[labels["outcome"]] = value
+                elif name == "api_retries":
+                    section = summary["api"].setdefault(labels["method"], {})
+                    section["retries"] = value
+        for section in summary["stages"].values():
+            if section.get("rows") and section.get("seconds"):
+                section["rows_per_second"] = round(section["rows"] / section["seconds"], 1)
+        return summary
+
+    def write(self, fname: str):
+        """Write JSON for `.json` files and OpenMetrics text otherwise, atomically."""
+        if fname.endswith(".json"):
+            content = json.dumps(self.to_json(), indent=2) + "\n"
+        else:
+            content = self.to_openmetrics()
+        tmp_fname = f"{fname}.tmp"
+        with open(tmp_fname, "w") as f:
+            f.write(content)
+        os.replace(tmp_fname, fname)
+
+    def serve(self, port: int, host: str = "127.0.0.1"):
+        """Serve `/metrics` (OpenMetrics) and `/metrics.json` in a background thread."""
+        # Imported only when serving, it takes a noticeable part of the startup
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == "/metrics":
+                    body = metrics.to_openmetrics().encode()
+                    content_type = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+                elif self.path == "/metrics.json":
+                    body = json.dumps(metrics.to_json()).encode()
+                    content_type = "application/json"
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+
+METRICS = Metrics()
+
+# The method of the Logs API call being made by the current thread, to
+# attribute the retries logged by the client library
+api_call = threading.local()
+
+
+def count_retries(record: logging.LogRecord) -> bool:
+    """Count the retries `tapi_yandex_metrika` warns about before repeating a request.
+
+    Works as a logger filter, so the warnings are still printed.
+    """
+    if record.levelno == logging.WARNING:
+        METRICS.add("api_retries", method=getattr(api_call, "method", None) or "unknown")
+    return True
+
+
+logging.getLogger("tapi_yandex_metrika.tapi_yandex_metrika").addFilter(count_retries)
+
+
+def add_metrics_arguments(arg_parser: argparse.ArgumentParser):
+    arg_parser.add_argument(
+        "--metrics-file",
+        metavar="PATH",
+        type=str,
+        help="write metrics on exit: JSON for *.json, OpenMetrics text otherwise",
+    )
+    arg_parser.add_argument(
+        "--metrics-port",
+        metavar="PORT",
+        type=int,
+        help="serve metrics on http://127.0.0.1:PORT/metrics while running",
+    )
+
+
+def start_metrics(args):
+    if args.metrics_port:
+        try:
+            METRICS.serve(args.metrics_port)
+        except OSError as e:
+            print(f"Can't serve metrics on port {args.metrics_port}: {e}", file=sys.stderr)
+            exit(1)
+    if args.metrics_file:
+        # Also on failures, which end with `exit()`
+        atexit.register(METRICS.write, args.metrics_file)
@@ -0,0 +1,172 @@
+"""`--profile` option of the scripts.
+
+Writes, next to the given prefix:
+
+- PREFIX.prof: cProfile statistics of the main thread (snakeviz, gprof2dot,
+  `python -m pstats`)
+- PREFIX.folded: sampled stacks of all threads in the collapsed format
+  (flamegraph.pl, speedscope, inferno)
+- PREFIX.memory.txt: with `--profile-memory`, the peak memory and what
+  holds it, by file and by line (tracemalloc)
+"""
+
+import os
+import sys
+import time
+import atexit
+import argparse
+import cProfile
+import threading
+import tracemalloc
+from collections import Counter
+
+# How often the stacks of the threads are sampled (seconds)
+SAMPLE_INTERVAL = 0.005
+# How often the traced memory is checked for a new peak (seconds), and by how
+# much it must grow to take a new snapshot
+MEMORY_CHECK_INTERVAL = 0.5
+MEMORY_SNAPSHOT_GROWTH = 1.1
+TOP_ALLOCATIONS = 30
+
+# Threads of the profiler itself are not sampled
+PROFILER_THREAD = "profiler"
+
+
+class StackSampler:
+    """Samples the stacks of the running threads in a background thread."""
+
+    def __init__(self, interval: float = SAMPLE_INTERVAL):
+        self.interval = interval
+        self.stacks = Counter()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name=PROFILER_THREAD, daemon=True)
+
+    @staticmethod
+    def frame_name(frame) -> str:
+        code = frame.f_code
+        return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            threads = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if threads.get(thread_id) == PROFILER_THREAD:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(self.frame_name(frame))
+                    frame = frame.f_back
+                stack.append(threads.get(thread_id, str(thread_id)))
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+    def write(self, fname: str):
+        with open(fname, "w") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+class PeakSnapshotter:
+    """Keeps a tracemalloc snapshot taken close to the peak of traced memory."""
+
+    def __init__(self, interval: float = MEMORY_CHECK_INTERVAL):
+        self.interval = interval
+        self.snapshot = None
+        self.snapshot_size = 0
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name=PROFILER_THREAD, daemon=True)
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            current, _ = tracemalloc.get_traced_memory()
+            if current > self.snapshot_size * MEMORY_SNAPSHOT_GROWTH:
+                self.snapshot = tracemalloc.take_snapshot()
+                self.snapshot_size = current
+
+    def start(self):
+        tracemalloc.start()
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+
+class Profiler:
+    def __init__(self, prefix: str, memory: bool = False):
+        self.prefix = prefix
+        self.memory = memory
+        self.cpu_profile = cProfile.Profile()
+        self.sampler = StackSampler()
+        self.snapshotter = PeakSnapshotter() if memory else None
+
+    def start(self):
+        if self.snapshotter:
+            self.snapshotter.start()
+        self.started_at = time.monotonic()
+        self.sampler.start()
+        self.cpu_profile.enable()
+
+    def stop(self):
+        self.cpu_profile.disable()
+        self.sampler.stop()
+        if self.snapshotter:
+            self.snapshotter.stop()
+        elapsed = time.monotonic() - self.started_at
+
+        self.cpu_profile.dump_stats(f"{self.prefix}.prof")
+        self.sampler.write(f"{self.prefix}.folded")
+        written = [f"{self.prefix}.prof", f"{self.prefix}.folded"]
+        if self.memory:
+            self.write_memory_report(f"{self.prefix}.memory.txt", elapsed)
+            written.append(f"{self.prefix}.memory.txt")
+        print(f"\nProfiles are saved in {', '.join(written)}", file=sys.stderr)
+
+    def write_memory_report(self, fname: str, elapsed: float):
+        _, peak = tracemalloc.get_traced_memory()
+        snapshots = [("at exit", tracemalloc.take_snapshot())]
+        if self.snapshotter.snapshot:
+            title = f"near the peak ({self.snapshotter.snapshot_size / 2**20:.1f} MiB)"
+            snapshots.insert(0, (title, self.snapshotter.snapshot))
+        tracemalloc.stop()
+
+        ignore = [tracemalloc.Filter(False, tracemalloc.__file__)]
+        with open(fname, "w") as f:
+            f.write(f"Run time: {elapsed:.1f} s\n")
+            f.write(f"Peak traced memory: {peak / 2**20:.1f} MiB\n")
+            for title, snapshot in snapshots:
+                snapshot = snapshot.filter_traces(ignore)
+                for key_type in ("filename", "lineno"):
+                    f.write(f"\nMemory {title} by {key_type}:\n\n")
+                    for stat in snapshot.statistics(key_type)[:TOP_ALLOCATIONS]:
+                        f.write(f"{stat.size / 2**20:10.2f} MiB {stat.count:10} blocks  ")
+                        f.write(f"{stat.traceback[0]}\n")
+
+
+def add_profile_arguments(arg_parser: argparse.ArgumentParser):
+    arg_parser.add_argument(
+        "--profile",
+        metavar="PREFIX",
+        type=str,
+        help="write CPU profiles to PREFIX.prof (cProfile) and PREFIX.folded (flame graphs)",
+    )
+    arg_parser.add_argument(
+        "--profile-memory",
+        action="store_true",
+        help="with --profile, also trace allocations to PREFIX.memory.txt (slower)",
+    )
+
+
+def start_profiling(args):
+    if not args.profile:
+        return
+    profiler = Profiler(args.profile, memory=args.profile_memory)
+    profiler.start()
+    # Also on failures, which end with `exit()`
+    atexit.register(profiler.stop)
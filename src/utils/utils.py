@@ -1,8 +1,60 @@
+import io
+import os
+import bz2
+import gzip
+import lzma
+import time
+import threading
+from contextlib import contextmanager
+from typing import BinaryIO, Iterator, TextIO
+
+# Compressed input files are recognized by extension
+DECOMPRESSORS = {
+    ".gz": lambda f: gzip.GzipFile(fileobj=f),
+    ".bz2": bz2.BZ2File,
+    ".xz": lzma.LZMAFile,
+}
+
+
 def fprint(line: str, **kwargs):
-    print("\r" + " " * 80, end="")
+    print("\r" + " " * 80, end="", **kwargs)
     print("\r" + line, end="", flush=True, **kwargs)
 
 
+@contextmanager
+def open_input_file(fname: str) -> Iterator[tuple[TextIO, BinaryIO]]:
+    """Open a possibly compressed text file for reading.
+
+    Yields the text stream and the underlying raw file. The position of
+    the raw file is the number of bytes consumed from disk, which is what
+    progress should be measured by for compressed files.
+    """
+    with open(fname, "rb") as raw:
+        decompressor = DECOMPRESSORS.get(os.path.splitext(fname)[1].lower())
+        stream = decompressor(raw) if decompressor else raw
+        with io.TextIOWrapper(stream, encoding="utf-8", newline="") as f:
+            yield f, raw
+
+
+class RateLimiter:
+    """Spaces calls evenly to at most `rate` per second, across threads."""
+
+    def __init__(self, rate: float | None):
+        self.interval = 1 / rate if rate else 0
+        self.next_call = 0.0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.monotonic()
+            delay = self.next_call - now
+            self.next_call = max(now, self.next_call) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+
+
 def populate_with_attribution(src_map: dict, attr_map: dict) -> dict:
     result = dict()
 